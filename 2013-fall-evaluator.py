@@ -26,14 +26,12 @@
 # output of the contest submission.
 #
 
-import argparse
-import heapq
-import logging
-import math
-import re
+import os
 import sys
-import uuid
-import json
+
+import engine
+from engine import (READ_BLOCK_SIZE, FallEventState, FallFormat, FallState, Report, Stats, TraceSink, attach_report,
+                    compile_events, instrument)
 
 # ---
 # The baseline score is that of running 100 nodes for each queue for 3 days + 1 hour (because
@@ -57,11 +55,24 @@ def calculate_score(vm_hours_used, test_case_id):
 
 
 def main():
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    args, rest = parse_arguments()
+    if args.debug:
+        set_logger()
+    if args.compile:
+        compile_events(read_file_events(rest[-1]), args.compile)
+        return
+    if args.batch:
+        score_batch(args.batch, args.test_case, args.results, args.processes)
+        return
+    input_file = rest[0]
+    output_file = rest[1]
     testcase_status = []
     score = 0
-    vm_hours_used, is_valid = evaluate_submission_output(output_file)
+    stats = Stats(progress=args.progress) if args.stats else None
+    if args.report and args.batch_billing:
+        sys.exit('--report bills one machine at a time, it does not go with --batch-billing')
+    vm_hours_used, is_valid = evaluate_submission_output(output_file, args.trace, stats, args.batch_billing,
+                                                         args.report, args.report_format, args.event_core)
     if is_valid:
         # We score this as if it were one of the solutions for a secret data set
         score += calculate_score(vm_hours_used, 3)
@@ -72,242 +83,148 @@ def main():
     print score
     print " ".join(str(i) for i in testcase_status)
 
+
+def read_manifest(path, test_case_id):
+    """ Lists the (output_file, test_case_id) pairs to score. The path is
+    either a directory, whose files are all scored as test_case_id, or a
+    manifest file with an output file and optionally its test case id on
+    each line. """
+    if os.path.isdir(path):
+        return [(os.path.join(path, name), test_case_id) for name in sorted(os.listdir(path))
+                if os.path.isfile(os.path.join(path, name))]
+    submissions = []
+    with open(path) as fd:
+        for line in fd:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            submissions.append((fields[0], int(fields[1]) if len(fields) > 1 else test_case_id))
+    return submissions
+
+
+def score_submission(submission):
+    """ Scores one output file the way main() does. Returns the row of the
+    results table: output file, test case, VM hours, penalties, validity,
+    score and error. An output which cannot be read or evaluated gets an
+    invalid row with the error, so that it does not stop the batch. """
+    output_file, test_case_id = submission
+    state = State()
+    try:
+        for event in read_file_events(output_file):
+            state.receive(event)
+            if state.overwait:
+                break
+        vm_hours_used = state.evaluate()
+    except SystemExit:
+        # dispatch exits as soon as a job cannot be run in time.
+        return (output_file, test_case_id, '', state.penalties, 0, 0, '')
+    except Exception as e:
+        error = ' '.join(('%s: %s' % (type(e).__name__, e)).split())
+        return (output_file, test_case_id, '', '', 0, 0, error)
+    if state.overwait:
+        return (output_file, test_case_id, vm_hours_used, state.penalties, 0, 0, '')
+    return (output_file, test_case_id, vm_hours_used, state.penalties, 1,
+            calculate_score(vm_hours_used, test_case_id), '')
+
+
+def score_batch(manifest, test_case_id=3, results_file=None, processes=None):
+    """ Scores the output files listed by the manifest on a pool of
+    processes and writes a tab separated results table. """
+    import multiprocessing
+    submissions = read_manifest(manifest, test_case_id)
+    pool = multiprocessing.Pool(processes)
+    fd = open(results_file, 'w') if results_file else sys.stdout
+    try:
+        fd.write('output\ttest_case\tvm_hours\tpenalties\tvalid\tscore\terror\n')
+        for row in pool.imap(score_submission, submissions):
+            fd.write('\t'.join(str(value) for value in row) + '\n')
+    finally:
+        pool.close()
+        pool.join()
+        if results_file:
+            fd.close()
+
 # --
 # Prezi Scale contest evaluator logic
 # From: https://raw.github.com/prezi/scale-contest-evaluator/master/evaluator.py
 # --
+# The rules and the log format of the fall contest.
+State = FallState
+FORMAT = FallFormat
+parse_line = FORMAT.parse_line
 
-class Event(object):
-    def __init__(self, data_dict):
-        # Note that timestamp is in UTC
-        self.timestamp = int(data_dict['timestamp'])
-
-    def __cmp__(self, other):
-        return cmp(self.timestamp, other.timestamp)
-
-
-class Job(Event):
-    def __init__(self, data_dict):
-        super(Job, self).__init__(data_dict)
-        self.category = data_dict['category']
-        self.duration = float(data_dict['duration'])
-        self.guid = data_dict['guid']
-
-
-class Command(Event):
-    def __init__(self, data_dict):
-        super(Command, self).__init__(data_dict)
-        self.category = data_dict['category']
-        self.cmd = data_dict['cmd']
-
-
-class Machine(object):
-    # VMs are billed by the hour (3600 seconds).
-    BILLING_UNIT = 3600
-    MACHINE_INACTIVE = 120
-
-    def __init__(self, booted, world):
-        self.active_from = booted + self.MACHINE_INACTIVE
-        # busy_till specifies when the job currently processed by the
-        # node will end (if any).
-        self.busy_till = 0
-        self.world = world
-        self.terminated = False
-        self.guid = str(uuid.uuid1())
-
-    def __cmp__(self, other):
-        now = self.world.now
-        return cmp(self.till_billing(now), other.till_billing(now))
-
-    @property
-    def running_since(self):
-        return self.active_from - self.MACHINE_INACTIVE
-
-    def till_billing(self, now):
-        """The number of seconds until the billing period ends."""
-        return abs((now - self.running_since) % -self.BILLING_UNIT)
-
-    def is_active(self, now):
-        """The machine has booted and it is currently unoccupied."""
-        return now >= self.active_from and self.busy_till <= now
-
-    def take_job(self, timestamp, length):
-        self.busy_till = self.job_runtime(timestamp, length)
-
-    def job_runtime(self, timestamp, length):
-        """The unix timestamp at which this machine can finish with a job of the given length."""
-        return max(self.active_from, self.busy_till, timestamp) + length
-
-class WithLog(object):
-    log = logging.getLogger('prezi.com')
-
-    def info(self, *args):
-        self.log.info(*args)
-
-
-class State(WithLog):
-
-    FREE_QUEUE_TIME = 5
-    MAX_QUEUE_TIME = 120
-    # TRIAL_ENDS refers to the grace period of the first 24 hours
-    # during which competitors will not be disqualified or penalized.
-    TRIAL_ENDS = 0 #24 * 60 * 60
-
-    def __init__(self):
-        self.time = 0
-        self.billed = 0
-        self.trial = None
-        self.overwait = False
-        self.jobs = {'url': [], 'default': [], 'export': []}
-        self.machines = {'url': [], 'default': [], 'export': []}
-
-    @property
-    def now(self):
-        return self.time
-
-    @now.setter
-    def now(self, value):
-        self.time = value
-        if self.trial is None:
-            self.trial = self.time + self.TRIAL_ENDS
-            self.info('trial_ends %d' % self.trial)
-
-    def receive(self, event):
-        self.now = event.timestamp
-        if isinstance(event, Job):
-            heapq.heappush(self.jobs[event.category], event)
-            self.process_events(event.category)
-        elif isinstance(event, Command):
-            if event.cmd == 'launch':
-                self.launch(Machine(event.timestamp, self), event.category)
-            self.process_events(event.category)
-            if event.cmd == 'terminate':
-                closest = heapq.nsmallest(1, self.machines[event.category])
-                if closest:
-                    self.terminate(closest[0], event.category)
-
-    def launch(self, machine, category):
-        heapq.heappush(self.machines[category], machine)
-        self.info('launch %d %d %s' % (machine.running_since, machine.busy_till, machine.guid))
-
-    def terminate(self, machine, category):
-        machine.terminated = True
-        bill = self.bill(category=category)
-        self.info('terminate %d %d %d %s' % (machine.running_since, machine.active_from, bill, machine.guid))
-
-    def process_events(self, category):
-        """ Processes one of the three queues in its entirety.
-        For each job, it takes the machine which is freed earliest
-        and assigns it the job.
-        """
-        while self.jobs[category]:
-            job = heapq.heappop(self.jobs[category])
-            self.info('job_retrieved %d %s' % (job.timestamp, job.guid))
-            best = None     # (rate, overrun, machine)
-            # Find a machine which can run the job within the "free time interval"
-            for machine in self.machines[category]:
-                if machine.is_active(job.timestamp + self.FREE_QUEUE_TIME):
-                    # Rate is the amount of time left after the job is done in the billing period.
-                    rate = machine.till_billing(machine.job_runtime(job.timestamp, job.duration))
-                    if best is None or rate < best[0]:
-                        best = (rate, 0, machine)
-            # Find a machine which can run the job before the contestant is disqualified.
-            if best is None:
-                for machine in self.machines[category]:
-                    if machine.is_active(job.timestamp + self.MAX_QUEUE_TIME):
-                        start_time = machine.job_runtime(job.timestamp, 0)
-                        if best is None or start_time < best[0]:
-                            best = (start_time, start_time - job.timestamp, machine)
-            if best is not None:
-                machine = best[2]
-                machine.take_job(job.timestamp, job.duration)
-                penalty = self.calculate_penalty(best[1])
-                if penalty > 0:
-                    self.info('job_penalty %d %s' % (penalty, job.guid))
-                    if self.now > self.trial:
-                        self.billed += penalty
-                self.info('job_executed_till %d %s %s' % (machine.busy_till, job.guid, machine.guid))
-            else:
-                self.info('no_machine_for %d %s' % (job.timestamp, job.guid))
-                self.overwait = job.timestamp >= self.trial
-                if self.overwait:
-                    sys.exit(1)
-
-    def bill(self, category=None):
-        bill_previous = self.billed
-        if category:
-            all_terminated = filter(lambda m: m.terminated, self.machines[category])
-            for machine in all_terminated:
-                self.bill_it(machine)
-            for machine in all_terminated:
-                self.machines[category].remove(machine)
-        else:
-            for _, machines in self.machines.items():
-                for machine in machines:
-                    self.bill_it(machine)
-        return self.billed - bill_previous
 
-    def bill_it(self, machine):
-        """ Computes the cost of a single virtual machine. """
-        if self.now > self.trial:
-            when_stops = max(self.now, machine.busy_till)
-            billing_start = max(self.trial, machine.running_since)
-            billing_end = max(self.trial, when_stops + machine.till_billing(when_stops))
-            self.billed += int(math.ceil(float(billing_end - billing_start) / machine.BILLING_UNIT))
+def read_events_re(fd):
+    return engine.read_events_re(fd, FORMAT)
 
-    def calculate_penalty(self, overrun):
-        return max(int(math.ceil(3.0 * (overrun - self.FREE_QUEUE_TIME) / self.MAX_QUEUE_TIME)), 0)
 
-    def evaluate(self):
-        for category in ['default', 'export', 'url']:
-            self.process_events(category)
-            for machine in list(self.machines[category]):
-                self.terminate(machine, category)
-            if self.overwait:
-                return -1
-        return self.billed
+def read_events(fd, block_size=READ_BLOCK_SIZE):
+    return engine.read_events(fd, FORMAT, block_size)
 
 
-def read_events(fd):
-    common = r'^(?P<timestamp>\d+) '
-    cmd_re = re.compile(common + r'(?P<cmd>[^ ]+) (?P<category>\w+)\s*$')
-    job_re = re.compile(common + r'(?P<duration>\d+\.\d+) (?P<guid>[^ ]+) (?P<category>\w+)\s*$')
-    line_no = 0
-    while True:
-        line = fd.readline()
-        line_no += 1
-        #if line_no % 1000 == 0:
-        #    print line_no
-        if not line:
-            break
-        m = job_re.match(line)
-        if m:
-            yield Job(m.groupdict())
-            continue
-        m = cmd_re.match(line)
-        if m:
-            yield Command(m.groupdict())
+def read_file_events(path):
+    return engine.read_file_events(path, FORMAT)
 
 
 def parse_arguments():
+    import argparse
     parser = argparse.ArgumentParser(description='Prezi scale contest evaluator')
     parser.add_argument('-d', '--debug', dest='debug', action='store_true', default=False, help='turn on debugging')
+    parser.add_argument('-t', '--trace', dest='trace', default=None, help='write the trace events as JSON lines to this file')
+    parser.add_argument('-c', '--compile', dest='compile', default=None,
+                        help='write the events of the output file to this compiled event file instead of scoring it')
+    parser.add_argument('-b', '--batch', dest='batch', default=None,
+                        help='score every output in this directory or manifest file instead')
+    parser.add_argument('--test-case', dest='test_case', type=int, default=3,
+                        help='test case id of the outputs without one in the batch')
+    parser.add_argument('-o', '--results', dest='results', default=None, help='write the batch results to this file')
+    parser.add_argument('-j', '--processes', dest='processes', type=int, default=None,
+                        help='number of processes scoring the batch')
+    parser.add_argument('--stats', dest='stats', action='store_true', default=False,
+                        help='count and time the work of the evaluation, and write a summary to stderr')
+    parser.add_argument('--progress', dest='progress', type=int, default=None, metavar='EVENTS',
+                        help='write a progress line to stderr every EVENTS events, with --stats')
+    parser.add_argument('--report', dest='report', default=None,
+                        help='write the costs and the use of the machines per hour and category to this file')
+    parser.add_argument('--report-format', dest='report_format', choices=['csv', 'json'], default='csv',
+                        help='format of the report: CSV or JSON lines')
+    parser.add_argument('--batch-billing', dest='batch_billing', action='store_true', default=False,
+                        help='record the machines terminated and the job overruns and bill them in one pass at the end')
+    parser.add_argument('-E', '--event-core', dest='event_core', action='store_true', default=False,
+                        help='simulate with the discrete event core, FallEventState')
     return parser.parse_known_args()
 
 
 def set_logger():
-    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    engine.set_logger(sys.stdout)
 
-def evaluate_submission_output(output_file):
+def evaluate_submission_output(output_file, trace_file=None, stats=None, batch_billing=False,
+                               report_file=None, report_format='csv', event_core=False):
     lines_read = 0
-    with open(output_file, 'r') as output_fd:
-        state = State()
-        for event in read_events(output_fd):
+    trace_fd = open(trace_file, 'w') if trace_file else None
+    report_fd = open(report_file, 'w') if report_file else None
+    try:
+        state = (FallEventState if event_core else State)(TraceSink(trace_fd) if trace_fd else None, batch_billing)
+        events = read_file_events(output_file)
+        if stats:
+            instrument(state, stats)
+            events = stats.read_events(events)
+        if report_fd:
+            attach_report(state, Report(report_fd, report_format))
+        for event in events:
             lines_read += 1
             state.receive(event)
             if state.overwait:
                 break
-    return state.evaluate(), not state.overwait
+        return state.evaluate(), not state.overwait
+    finally:
+        if trace_fd:
+            trace_fd.close()
+        if report_fd:
+            report_fd.close()
+        # An overwait exits from process_events, the summary is written then too.
+        if stats:
+            stats.report()
 
 
 if __name__ ==  '__main__':
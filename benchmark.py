@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import argparse
+import imp
+import itertools
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate_log
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {
+    'spring': 'evaluator.py',
+    'fall': '2013-fall-evaluator.py',
+}
+# The events are handed to State.receive in lists of this many, so that
+# parsing is not timed with it.
+RECEIVE_CHUNK = 10000
+UNITS = {'k': 1000, 'M': 1000 * 1000}
+# The lines of the log the startup time is measured on.
+STARTUP_LINES = 100
+# Prints the modules which importing the script given as its argument loads.
+# The script imports the engine next to it from any working directory.
+LIST_MODULES = """
+import imp, os, sys
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+loaded = set(sys.modules)
+imp.load_source('evaluator', sys.argv[1])
+print ' '.join(sorted(name for name in set(sys.modules) - loaded if sys.modules[name] is not None))
+"""
+
+
+def load_evaluator(name):
+    return imp.load_source('%s_evaluator' % name, os.path.join(HERE, SCRIPTS[name]))
+
+
+def peak_rss():
+    """ Peak resident set size of this process in megabytes. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def time_phases(name, path, results):
+    """ Times read_events, State.receive (which runs process_events) and
+    State.bill on the log, and puts (phase, seconds, events, peak RSS)
+    tuples on results, followed by None. """
+    module = load_evaluator(name)
+    try:
+        start = time.time()
+        with open(path) as fd:
+            count = sum(1 for _ in module.read_events(fd))
+        results.put(('read_events', time.time() - start, count, peak_rss()))
+
+        state = module.State()
+        elapsed = 0.0
+        count = 0
+        with open(path) as fd:
+            events = module.read_events(fd)
+            for chunk in iter(lambda: list(itertools.islice(events, RECEIVE_CHUNK)), []):
+                start = time.time()
+                for event in chunk:
+                    state.receive(event)
+                    if state.overwait:
+                        break
+                elapsed += time.time() - start
+                count += len(chunk)
+                if state.overwait:
+                    break
+        results.put(('process_events', elapsed, count, peak_rss()))
+
+        machines = sum(len(pool) for pool in state.machines.values())
+        start = time.time()
+        state.bill()
+        results.put(('bill', time.time() - start, machines, peak_rss()))
+    except BaseException as e:
+        # The fall evaluator exits on an overwait.
+        results.put(('error', 0.0, 0, '%s: %s' % (type(e).__name__, e)))
+    results.put(None)
+
+
+def time_main(name, path):
+    """ Runs the evaluator script on the log and returns the seconds it
+    took, its exit status and its peak RSS in megabytes. """
+    script = os.path.join(HERE, SCRIPTS[name])
+    command = [sys.executable, script, path] if name == 'spring' else [sys.executable, script, path, path]
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        child = subprocess.Popen(command, stdout=devnull)
+        _, status, usage = os.wait4(child.pid, 0)
+        elapsed = time.time() - start
+    return elapsed, os.WEXITSTATUS(status), usage.ru_maxrss / 1024.0
+
+
+def time_startup(name, path, runs):
+    """ Runs the evaluator script on a log of a few lines runs times and
+    returns the shortest and the median seconds of a run, followed by the
+    modules importing the script loads. """
+    times = sorted(time_main(name, path)[0] for _ in range(runs))
+    modules = subprocess.check_output([sys.executable, '-c', LIST_MODULES, os.path.join(HERE, SCRIPTS[name])])
+    return times[0], times[len(times) // 2], modules.split()
+
+
+def log_path(directory, name, scale, seed):
+    """ Returns the path of the generated log of the scale, writing it
+    unless it is there already from an earlier run. """
+    path = os.path.join(directory, '%s-%d-%d.log' % (name, scale, seed))
+    if not os.path.exists(path):
+        generator = generate_log.LogGenerator(name, seed=seed)
+        with open(path + '.tmp', 'w') as fd:
+            generate_log.write_log(generator, scale, fd)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def benchmark(name, scale, path):
+    """ Yields (phase, seconds, events, peak RSS) for every phase, the in
+    process ones timed in a child process of their own so that the scales
+    do not share a peak RSS. The events of bill are the machines billed,
+    those of main the lines of the log. """
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=time_phases, args=(name, path, results))
+    child.start()
+    for result in iter(results.get, None):
+        yield result
+    child.join()
+    elapsed, status, rss = time_main(name, path)
+    yield ('main' if status == 0 else 'main (exit %d)' % status), elapsed, scale, rss
+
+
+def parse_scale(text):
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks of the Prezi scale contest evaluators')
+    parser.add_argument('-e', '--evaluator', dest='evaluator', choices=sorted(SCRIPTS), default='spring',
+                        help='the evaluator to benchmark')
+    parser.add_argument('-n', '--scales', dest='scales', default='10k,100k,1M',
+                        help='comma separated numbers of log lines, with k and M suffixes, up to 100M')
+    parser.add_argument('-s', '--seed', dest='seed', type=int, default=1, help='seed of the generated logs')
+    parser.add_argument('-D', '--directory', dest='directory', default=None,
+                        help='keep the generated logs in this directory and reuse them; temporary by default')
+    parser.add_argument('--startup', dest='startup', type=int, default=None, metavar='RUNS',
+                        help='time the startup of the evaluator instead, the best and the median of this many '
+                             'runs on a log of %d lines' % STARTUP_LINES)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    directory = args.directory or tempfile.mkdtemp(prefix='scale-benchmark-')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    try:
+        if args.startup:
+            path = log_path(directory, args.evaluator, STARTUP_LINES, args.seed)
+            best, median, modules = time_startup(args.evaluator, path, args.startup)
+            print 'startup: best %.1f ms, median %.1f ms' % (best * 1000, median * 1000)
+            print 'modules imported (%d): %s' % (len(modules), ' '.join(modules))
+            return
+        print '%-10s %-16s %10s %12s %12s' % ('lines', 'phase', 'seconds', 'events/s', 'peak RSS MB')
+        for scale in map(parse_scale, args.scales.split(',')):
+            path = log_path(directory, args.evaluator, scale, args.seed)
+            for phase, elapsed, events, rss in benchmark(args.evaluator, scale, path):
+                if phase == 'error':
+                    print '%-10d %-16s %s' % (scale, phase, rss)
+                    continue
+                rate = events / elapsed if elapsed else float('inf')
+                print '%-10d %-16s %10.3f %12.0f %12.1f' % (scale, phase, elapsed, rate, rss)
+                sys.stdout.flush()
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
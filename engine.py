@@ -0,0 +1,1670 @@
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# The simulation of the Prezi Scale contest, shared by evaluator.py and
+# 2013-fall-evaluator.py: the machines, their billing and the rules and
+# log formats of both contests.
+#
+import array
+import bisect
+import collections
+import heapq
+import itertools
+import math
+import re
+import struct
+import sys
+import time
+
+
+class Event(object):
+    __slots__ = ('timestamp',)
+
+    def __init__(self, timestamp):
+        # Note that timestamp is in UTC
+        self.timestamp = timestamp
+
+    def __cmp__(self, other):
+        return cmp(self.timestamp, other.timestamp)
+
+
+class Job(Event):
+    __slots__ = ('category', 'duration', 'guid')
+
+    def __init__(self, timestamp, category, duration, guid):
+        super(Job, self).__init__(timestamp)
+        self.category = category
+        self.duration = duration
+        self.guid = guid
+
+    @property
+    def elapsed(self):
+        """ The duration, by the name of the spring log. """
+        return self.duration
+
+
+class Command(Event):
+    __slots__ = ('category', 'cmd')
+
+    def __init__(self, timestamp, category, cmd):
+        super(Command, self).__init__(timestamp)
+        self.category = category
+        self.cmd = cmd
+
+
+class Machine(object):
+    # VMs are billed by the hour (3600 seconds).
+    BILLING_UNIT = 3600
+    # Boot time is 2 minutes (120 seconds).
+    MACHINE_INACTIVE = 120
+
+    __slots__ = ('active_from', 'busy_till', 'terminated', 'seq', '_guid')
+
+    def __init__(self, booted):
+        self.active_from = booted + self.MACHINE_INACTIVE
+        # busy_till specifies when the job currently processed by the
+        # node will end (if any).
+        self.busy_till = 0
+        self.terminated = False
+        self._guid = None
+
+    @property
+    def guid(self):
+        """ Generated when it is first asked for, which only a trace does. """
+        if self._guid is None:
+            import uuid
+            self._guid = str(uuid.uuid1())
+        return self._guid
+
+    @property
+    def running_since(self):
+        return self.active_from - self.MACHINE_INACTIVE
+
+    @property
+    def phase(self):
+        """ The second of the billing period at which the machine was started. """
+        return self.running_since % self.BILLING_UNIT
+
+    def till_billing(self, now):
+        """ The number of seconds until the billing period ends. """
+        return abs((now - self.running_since) % -self.BILLING_UNIT)
+
+    def is_active(self, now):
+        """ The machine has booted and it is currently unoccupied. """
+        return now >= self.active_from and self.busy_till <= now
+
+    def job_runtime(self, timestamp, length):
+        """ The unix timestamp at which this machine can finish with a job
+        of the given length. """
+        return max(self.active_from, self.busy_till, timestamp) + length
+
+    @property
+    def free_from(self):
+        """ The earliest time at which is_active holds. """
+        return max(self.active_from, self.busy_till)
+
+
+class MachinePool(object):
+    """ The machines of one category, in the order of the list the
+    contests kept them in, which breaks the ties between them: heapq pushed
+    every new machine into it by the time left of the billing periods at
+    its launch, and removals kept the order of the rest.
+
+    Every place in the list has a sequence number, increasing along the
+    list, and the machine in it has its seq. The machines are indexed so
+    that the machine for a job or for a terminate is found in O(log n).
+    Given the latest time asked for, the horizon:
+
+    order   -- sequence numbers of all machines, sorted
+    phases  -- (phase, seq) of all machines, sorted
+    free    -- sequence numbers of the machines with free_from <= horizon, sorted
+    waiting -- (free_from, seq) of the other machines, sorted
+
+    lingering holds the terminated machines terminate left in the list.
+    scanned counts the machines looked at to find the ones asked for.
+    """
+
+    def __init__(self):
+        self.machines = {}
+        self.sequence = 0
+        self.scanned = 0
+        self.horizon = 0
+        self.order = []
+        self.phases = []
+        self.free = []
+        self.waiting = []
+        self.lingering = []
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        for seq in self.order:
+            yield self.machines[seq]
+
+    def push(self, machine, now):
+        """ Adds the machine where heapq.heappush puts it: at the end of the
+        list, then up past the parents with more time left of their billing
+        period at now. The parents move down into the places it leaves. """
+        self.order.append(self.sequence)
+        self.sequence += 1
+        position = len(self.order) - 1
+        left = machine.till_billing(now)
+        while position > 0:
+            parent = (position - 1) >> 1
+            other = self.machines[self.order[parent]]
+            if not left < other.till_billing(now):
+                break
+            self.move(other, self.order[position])
+            position = parent
+        machine.seq = self.order[position]
+        self.machines[machine.seq] = machine
+        bisect.insort(self.phases, (machine.phase, machine.seq))
+        self.insert(machine)
+
+    def move(self, machine, seq):
+        """ Moves the machine to the place of seq in the list. """
+        self.discard(machine)
+        del self.phases[bisect.bisect_left(self.phases, (machine.phase, machine.seq))]
+        machine.seq = seq
+        self.machines[seq] = machine
+        bisect.insort(self.phases, (machine.phase, seq))
+        self.insert(machine)
+
+    def remove(self, machine):
+        self.discard(machine)
+        del self.phases[bisect.bisect_left(self.phases, (machine.phase, machine.seq))]
+        del self.order[bisect.bisect_left(self.order, machine.seq)]
+        del self.machines[machine.seq]
+
+    def terminate(self, machine):
+        """ Removes the machine the way list.remove did, and returns the
+        terminated machines to bill. list.remove took the first machine in
+        the list comparing equal, the first one of the same phase. That is
+        the machine itself, but for the terminations of evaluate going
+        through the list: there it may take an earlier machine, which is
+        never billed, and leave the terminated one in the list, billed again
+        with every termination after. """
+        billed = self.lingering + [machine]
+        for terminated in billed:
+            i = bisect.bisect_left(self.phases, (terminated.phase, -1))
+            self.remove(self.machines[self.phases[i][1]])
+        self.lingering = [terminated for terminated in billed if self.machines.get(terminated.seq) is terminated]
+        return billed
+
+    def insert(self, machine):
+        if machine.free_from <= self.horizon:
+            bisect.insort(self.free, machine.seq)
+        else:
+            bisect.insort(self.waiting, (machine.free_from, machine.seq))
+
+    def discard(self, machine):
+        if machine.free_from <= self.horizon:
+            del self.free[bisect.bisect_left(self.free, machine.seq)]
+        else:
+            del self.waiting[bisect.bisect_left(self.waiting, (machine.free_from, machine.seq))]
+
+    def occupy(self, machine, busy_till):
+        """ Sets busy_till of the machine and moves it in the index. """
+        self.discard(machine)
+        machine.busy_till = busy_till
+        self.insert(machine)
+
+    def advance(self, now):
+        """ Moves the horizon to now and the machines free by then to free. """
+        self.horizon = now
+        end = bisect.bisect_right(self.waiting, (now, float('inf')))
+        for _, seq in self.waiting[:end]:
+            bisect.insort(self.free, seq)
+        del self.waiting[:end]
+
+    def find_active(self, start, now):
+        """ Returns the first machine active at now, scanning the machines
+        from the start-th one and wrapping around, or None. """
+        if now < self.horizon:
+            # The index only answers for times from the horizon on.
+            n = len(self.order)
+            for i in range(n):
+                machine = self.machines[self.order[(start + i) % n]]
+                if machine.is_active(now):
+                    self.scanned += i + 1
+                    return machine
+            self.scanned += n
+            return None
+        self.advance(now)
+        if not self.free:
+            return None
+        self.scanned += 1
+        i = bisect.bisect_left(self.free, self.order[start])
+        return self.machines[self.free[i % len(self.free)]]
+
+    def closest_to_billing(self, now):
+        """ Returns the machine with the least time left of its billing
+        period at now, the first in the list on a tie, or None. The phase
+        of a machine does not change, the one asked for is the next phase
+        from now on. """
+        if not self.phases:
+            return None
+        phase = int(math.ceil(now % Machine.BILLING_UNIT))
+        i = bisect.bisect_left(self.phases, (phase, -1))
+        return self.machines[self.phases[i % len(self.phases)][1]]
+
+
+class RatePool(MachinePool):
+    """ A MachinePool for the machine with the best billing rate for a
+    job: free holds the (phase, seq) of the free machines, sorted. A job
+    of a given length finishes at the same time on every free machine,
+    the one with the best rate is the next phase from that time on. """
+
+    def insert(self, machine):
+        if machine.free_from <= self.horizon:
+            bisect.insort(self.free, (machine.phase, machine.seq))
+        else:
+            bisect.insort(self.waiting, (machine.free_from, machine.seq))
+
+    def discard(self, machine):
+        if machine.free_from <= self.horizon:
+            del self.free[bisect.bisect_left(self.free, (machine.phase, machine.seq))]
+        else:
+            del self.waiting[bisect.bisect_left(self.waiting, (machine.free_from, machine.seq))]
+
+    def take_job(self, machine, timestamp, length):
+        """ Gives the job to the machine and moves it in the index. """
+        self.occupy(machine, machine.job_runtime(timestamp, length))
+
+    def advance(self, now):
+        """ Moves the horizon to now and the machines free by then to free. """
+        self.horizon = now
+        end = bisect.bisect_right(self.waiting, (now, float('inf')))
+        for _, seq in self.waiting[:end]:
+            bisect.insort(self.free, (self.machines[seq].phase, seq))
+        del self.waiting[:end]
+
+    def scan(self, timestamp, length, free_time, max_time):
+        """ Looks for the machine of best_machine by checking all of them. """
+        self.scanned += len(self)
+        best = None
+        for machine in self:
+            if machine.is_active(timestamp + free_time):
+                rate = machine.till_billing(machine.job_runtime(timestamp, length))
+                if best is None or rate < best[0]:
+                    best = (rate, 0, machine)
+        if best is None:
+            self.scanned += len(self)
+            for machine in self:
+                if machine.is_active(timestamp + max_time):
+                    start_time = machine.job_runtime(timestamp, 0)
+                    if best is None or start_time < best[0]:
+                        best = (start_time, start_time - timestamp, machine)
+        return best
+
+    def best_machine(self, timestamp, length, free_time, max_time):
+        """ Returns (rate, 0, machine) for the machine which is active within
+        free_time and has the least time left in its billing period after
+        the job. If there is none, (start_time, overrun, machine) for the
+        machine active within max_time which starts the job the earliest.
+        Returns None if neither exists. The first machine in the list wins
+        a tie. """
+        if timestamp < self.horizon:
+            # The index only answers for times from the horizon on.
+            return self.scan(timestamp, length, free_time, max_time)
+        self.advance(timestamp)
+        best = None
+        if self.free:
+            runtime = timestamp + length
+            phase = int(math.ceil(runtime % Machine.BILLING_UNIT))
+            i = bisect.bisect_left(self.free, (phase, -1))
+            seq = self.free[i % len(self.free)][1]
+            best = (self.machines[seq].till_billing(runtime), seq)
+            self.scanned += 1
+        end = bisect.bisect_right(self.waiting, (timestamp + free_time, float('inf')))
+        self.scanned += end
+        for _, seq in self.waiting[:end]:
+            machine = self.machines[seq]
+            candidate = (machine.till_billing(machine.job_runtime(timestamp, length)), seq)
+            if best is None or candidate < best:
+                best = candidate
+        if best is not None:
+            return (best[0], 0, self.machines[best[1]])
+        if self.waiting and self.waiting[0][0] <= timestamp + max_time:
+            self.scanned += 1
+            machine = self.machines[self.waiting[0][1]]
+            start_time = machine.job_runtime(timestamp, 0)
+            return (start_time, start_time - timestamp, machine)
+        return None
+
+
+class TraceSink(object):
+    """ Writes trace events as JSON lines, the name of the event followed
+    by its values. """
+
+    def __init__(self, fd):
+        import json
+        self.fd = fd
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def write(self, event, values):
+        self.fd.write(self.encode((event,) + values))
+        self.fd.write('\n')
+
+
+class WithLog(object):
+    # The logger of the traces, which set_logger sets under --debug; logging
+    # is not even imported otherwise.
+    log = None
+    # logging.INFO
+    LOG_LEVEL = 20
+    TRACE_FORMATS = {
+        'trial_ends': 'trial_ends %d',
+        'launch': 'launch %d %d %s',
+        'terminate': 'terminate %d %d %d %s',
+        'job_retrieved': 'job_retrieved %d %s',
+        'job_penalty': 'job_penalty %d %s',
+        'job_executed_till': 'job_executed_till %d %s %s',
+        'no_machine_for': 'no_machine_for %d %s',
+    }
+
+    def __init__(self, sink=None):
+        self.set_sink(sink)
+
+    def set_sink(self, sink):
+        self.sink = sink
+        # Callers check tracing first, so a disabled trace costs nothing.
+        self.tracing = sink is not None or (self.log is not None and self.log.isEnabledFor(self.LOG_LEVEL))
+
+    def __getstate__(self):
+        """ The sink stays with the process, a pickled object is restored
+        without one. """
+        state = self.__dict__.copy()
+        del state['sink'], state['tracing']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.set_sink(None)
+
+    def trace(self, event, *values):
+        """ Logs the event, formatted only if the log is printed, and hands
+        it to the sink if there is one. """
+        if self.log is not None:
+            self.log.info(self.TRACE_FORMATS[event], *values)
+        if self.sink is not None:
+            self.sink.write(event, values)
+
+
+class State(WithLog):
+    """ The simulation: the queues of the jobs and the pools of the machines
+    of every category, and the bill. A rule set subclasses it with its
+    categories and queue times, the order in which it receives an event
+    and how a job gets its machine. """
+
+    CATEGORIES = []
+    # TRIAL_ENDS refers to the grace period of the first 24 hours
+    # during which competitors will not be disqualified or penalized.
+    TRIAL_ENDS = 24 * 60 * 60
+    # After the grace period, this is the maximum time a job can spend in
+    # the queue.
+    MAX_QUEUE_TIME = 5
+    POOL = MachinePool
+
+    def __init__(self, sink=None, trial=None, batch_billing=False):
+        super(State, self).__init__(sink)
+        self.time = 0
+        self.billed = 0
+        self.trial = trial
+        self.overwait = False
+        self.jobs = dict((category, []) for category in self.CATEGORIES)
+        self.machines = dict((category, self.POOL()) for category in self.CATEGORIES)
+        # A trace carries the bill of every machine, so it bills them one by one.
+        self.batch = BatchBill(self.CATEGORIES) if batch_billing and not self.tracing else None
+        self.billed_by_category = None
+
+    @property
+    def now(self):
+        return self.time
+
+    @now.setter
+    def now(self, value):
+        self.time = value
+        if self.trial is None:
+            self.trial = self.time + self.TRIAL_ENDS
+            if self.tracing:
+                self.trace('trial_ends', self.trial)
+
+    def receive(self, event):
+        raise NotImplementedError
+
+    def dispatch(self, job):
+        raise NotImplementedError
+
+    def launch(self, machine, category):
+        self.machines[category].push(machine, self.now)
+        if self.tracing:
+            self.trace('launch', machine.running_since, machine.busy_till, machine.guid)
+
+    def terminate(self, machine, category):
+        machine.terminated = True
+        billed = self.machines[category].terminate(machine)
+        if self.batch is not None:
+            for terminated in billed:
+                self.defer_bill(terminated, category)
+            return
+        bill = sum(self.bill(terminated) for terminated in billed)
+        if self.tracing:
+            self.trace('terminate', machine.running_since, machine.active_from, bill, machine.guid)
+
+    def process_events(self, category):
+        while self.jobs[category]:
+            self.dispatch(heapq.heappop(self.jobs[category]))
+
+    def bill(self, machine=None):
+        """ Bills a single machine, or all of them if none is given.
+        Returns the amount billed. """
+        bill_previous = self.billed
+        if machine is not None:
+            self.bill_it(machine)
+        else:
+            for _, machines in self.machines.items():
+                for machine in machines:
+                    self.bill_it(machine)
+        return self.billed - bill_previous
+
+    def bill_it(self, machine):
+        """ Computes the cost of a single virtual machine. """
+        if self.now > self.trial:
+            when_stops = max(self.now, machine.busy_till)
+            billing_start = max(self.trial, machine.running_since)
+            billing_end = max(self.trial, when_stops + machine.till_billing(when_stops))
+            self.billed += int(math.ceil(float(billing_end - billing_start) / machine.BILLING_UNIT))
+
+    def defer_bill(self, machine, category):
+        """ Records the machine for the batch bill, if bill_it would bill it. """
+        if self.now > self.trial:
+            self.batch.machine(category, machine.running_since, max(self.now, machine.busy_till))
+
+    def settle(self):
+        """ Adds the batch bill of the machines recorded so far to billed. """
+        self.billed_by_category = self.batch.hours(self.trial, Machine.BILLING_UNIT)
+        self.billed += sum(self.billed_by_category.values())
+        self.batch.clear()
+
+    def running(self, category):
+        """ The machines evaluate terminates. """
+        return list(self.machines[category])
+
+    def evaluate(self):
+        for category in self.CATEGORIES:
+            self.process_events(category)
+            for machine in self.running(category):
+                self.terminate(machine, category)
+            if self.overwait:
+                return -1
+        if self.batch is not None:
+            self.settle()
+        return self.billed
+
+
+class SpringState(State):
+    """ The rules of the 2013 spring contest: a job gets a machine free
+    within MAX_QUEUE_TIME, found from a random position, and a job which
+    finds none after the trial period disqualifies the run. """
+
+    CATEGORIES = ['general', 'export', 'url']
+
+    def __init__(self, sink=None, seed=None, trial=None, batch_billing=False):
+        import random
+        super(SpringState, self).__init__(sink, trial, batch_billing)
+        # Every category draws from its own random generator, so the
+        # choices do not depend on the events of the other categories. The
+        # seeds are integers: a string seed goes through hash(), which
+        # changes with PYTHONHASHSEED and the build.
+        self.random = dict((category, random.Random(None if seed is None else
+                                                    seed * len(self.CATEGORIES) + self.CATEGORIES.index(category)))
+                           for category in self.CATEGORIES)
+
+    def receive(self, event):
+        self.now = event.timestamp
+        if isinstance(event, Job):
+            heapq.heappush(self.jobs[event.category], event)
+            self.process_events(event.category)
+        elif isinstance(event, Command):
+            self.process_events(event.category)
+            if event.cmd == 'launch':
+                self.launch(Machine(event.timestamp), event.category)
+            elif event.cmd == 'terminate':
+                closest = self.machines[event.category].closest_to_billing(self.now)
+                if closest is not None:
+                    self.terminate(closest, event.category)
+
+    def rnd_machine(self, category, now):
+        """ Returns an active machine, scanning from a random position. """
+        machines = self.machines[category]
+        return machines.find_active(self.random[category].randrange(len(machines)), now)
+
+    def dispatch(self, job):
+        if self.tracing:
+            self.trace('job_retrieved', job.timestamp, job.guid)
+        machine = self.rnd_machine(job.category, job.timestamp + self.MAX_QUEUE_TIME)
+        if machine is not None:
+            self.machines[job.category].occupy(machine, max(machine.busy_till, job.timestamp) + job.duration)
+            if self.tracing:
+                self.trace('job_executed_till', machine.busy_till, job.guid, machine.guid)
+        else:
+            if self.tracing:
+                self.trace('no_machine_for', job.timestamp, job.guid)
+            self.overwait = job.timestamp > self.trial
+
+    def running(self, category):
+        """ The pool itself: terminating a machine while iterating over the
+        pool skips the next one, and the bills of the spring rules count
+        on it. """
+        return self.machines[category]
+
+
+class FallState(State):
+    """ The rules of the 2013 fall contest: a job gets the machine with the
+    best billing rate free within FREE_QUEUE_TIME, or the one free the
+    earliest within MAX_QUEUE_TIME at a penalty, and a job which finds
+    none ends the run. There is no trial period. """
+
+    CATEGORIES = ['default', 'export', 'url']
+    FREE_QUEUE_TIME = 5
+    MAX_QUEUE_TIME = 120
+    TRIAL_ENDS = 0 #24 * 60 * 60
+    POOL = RatePool
+
+    def __init__(self, sink=None, batch_billing=False):
+        super(FallState, self).__init__(sink, None, batch_billing)
+        # The part of billed which comes from penalties.
+        self.penalties = 0
+
+    def receive(self, event):
+        self.now = event.timestamp
+        if isinstance(event, Job):
+            heapq.heappush(self.jobs[event.category], event)
+            self.process_events(event.category)
+        elif isinstance(event, Command):
+            if event.cmd == 'launch':
+                self.launch(Machine(event.timestamp), event.category)
+            self.process_events(event.category)
+            if event.cmd == 'terminate':
+                closest = self.machines[event.category].closest_to_billing(self.now)
+                if closest is not None:
+                    self.terminate(closest, event.category)
+
+    def dispatch(self, job):
+        """ Takes the machine which is freed earliest and assigns it the job. """
+        if self.tracing:
+            self.trace('job_retrieved', job.timestamp, job.guid)
+        machines = self.machines[job.category]
+        best = machines.best_machine(job.timestamp, job.duration, self.FREE_QUEUE_TIME, self.MAX_QUEUE_TIME)
+        if best is not None:
+            machine = best[2]
+            machines.take_job(machine, job.timestamp, job.duration)
+            if self.batch is not None:
+                # Overruns up to FREE_QUEUE_TIME are not penalized.
+                if best[1] > self.FREE_QUEUE_TIME and self.now > self.trial:
+                    self.batch.overrun(job.category, best[1])
+                return
+            penalty = self.calculate_penalty(best[1])
+            if penalty > 0:
+                if self.tracing:
+                    self.trace('job_penalty', penalty, job.guid)
+                if self.now > self.trial:
+                    self.billed += penalty
+                    self.penalties += penalty
+            if self.tracing:
+                self.trace('job_executed_till', machine.busy_till, job.guid, machine.guid)
+        else:
+            if self.tracing:
+                self.trace('no_machine_for', job.timestamp, job.guid)
+            self.overwait = job.timestamp >= self.trial
+            if self.overwait:
+                sys.exit(1)
+
+    def calculate_penalty(self, overrun):
+        return max(int(math.ceil(3.0 * (overrun - self.FREE_QUEUE_TIME) / self.MAX_QUEUE_TIME)), 0)
+
+    def settle(self):
+        """ Adds the batch bill of the machines and the overruns recorded so
+        far to billed. """
+        hours = self.batch.hours(self.trial, Machine.BILLING_UNIT)
+        penalties = self.batch.penalties(self.FREE_QUEUE_TIME, self.MAX_QUEUE_TIME)
+        self.billed_by_category = dict((category, hours[category] + penalties[category]) for category in hours)
+        self.billed += sum(self.billed_by_category.values())
+        self.penalties += sum(penalties.values())
+        self.batch.clear()
+
+
+class Strategy(object):
+    """ A competitor running in the process of the evaluator. The methods
+    return the commands to issue as lists of (command, category) pairs, and
+    the commands take the time of the event they answer. It is defined
+    here, not in evaluator.py, so that there is one class whether the
+    script runs as __main__ or is imported as evaluator. """
+
+    def start(self, event):
+        """ Commands issued before the first event. """
+        return []
+
+    def on_job(self, job):
+        """ Commands issued right after a job arrived. """
+        return []
+
+    def finish(self, event):
+        """ Commands issued after the last event. """
+        return []
+
+
+class EventQueue(object):
+    """ A priority queue of (time, item) events. Events of the same time
+    come in the order they were pushed in. """
+
+    def __init__(self):
+        self.heap = []
+        self.pushed = 0
+
+    def push(self, time, item):
+        heapq.heappush(self.heap, (time, self.pushed, item))
+        self.pushed += 1
+
+    def due(self, time):
+        """ Pops and yields the (time, item) events up to time. """
+        heap = self.heap
+        while heap and heap[0][0] <= time:
+            event_time, _, item = heapq.heappop(heap)
+            yield event_time, item
+
+
+class EventPool(MachinePool):
+    """ A MachinePool whose machines which are not free yet wait on the
+    event queue of an EventCore, as the release at their free_from: the
+    end of their boot or of their last job. The releases are not taken
+    back when a machine gets a job or is terminated; a release which does
+    not match the machine any more is dropped when it comes. """
+
+    def __init__(self, queue):
+        super(EventPool, self).__init__()
+        self.queue = queue
+
+    def insert(self, machine):
+        if machine.free_from <= self.horizon:
+            bisect.insort(self.free, machine.seq)
+        else:
+            self.queue.push(machine.free_from, (self, machine))
+
+    def discard(self, machine):
+        if machine.free_from <= self.horizon:
+            del self.free[bisect.bisect_left(self.free, machine.seq)]
+
+    def move(self, machine, seq):
+        """ Only the free machines are indexed by seq, the releases of the
+        others hold the machine itself. """
+        free = machine.free_from <= self.horizon
+        if free:
+            self.discard(machine)
+        del self.phases[bisect.bisect_left(self.phases, (machine.phase, machine.seq))]
+        machine.seq = seq
+        self.machines[seq] = machine
+        bisect.insort(self.phases, (machine.phase, seq))
+        if free:
+            bisect.insort(self.free, seq)
+
+    def release(self, machine, time):
+        if self.machines.get(machine.seq) is not machine or machine.free_from != time:
+            return
+        i = bisect.bisect_left(self.free, machine.seq)
+        if i == len(self.free) or self.free[i] != machine.seq:
+            self.free.insert(i, machine.seq)
+
+    def advance(self, now):
+        """ The machines are moved to free by their releases. """
+
+
+class RateEventPool(RatePool):
+    """ A RatePool whose waiting machines are moved to free by their
+    releases on the event queue of a FallEventState, at their free_from,
+    rather than by advance. As in an EventPool the releases are not taken
+    back; a release which does not match the machine any more is dropped
+    when it comes. """
+
+    def __init__(self, queue):
+        super(RateEventPool, self).__init__()
+        self.queue = queue
+
+    def insert(self, machine):
+        super(RateEventPool, self).insert(machine)
+        if machine.free_from > self.horizon:
+            self.queue.push(machine.free_from, (self, machine))
+
+    def move(self, machine, seq):
+        """ The release of a waiting machine holds the machine itself, so it
+        stays on the queue. """
+        self.discard(machine)
+        del self.phases[bisect.bisect_left(self.phases, (machine.phase, machine.seq))]
+        machine.seq = seq
+        self.machines[seq] = machine
+        bisect.insort(self.phases, (machine.phase, seq))
+        super(RateEventPool, self).insert(machine)
+
+    def release(self, machine, time):
+        if self.machines.get(machine.seq) is not machine or machine.free_from != time:
+            return
+        i = bisect.bisect_left(self.waiting, (time, machine.seq))
+        if i < len(self.waiting) and self.waiting[i] == (time, machine.seq):
+            del self.waiting[i]
+            bisect.insort(self.free, (machine.phase, machine.seq))
+
+    def advance(self, now):
+        """ The machines are moved to free by their releases. """
+
+
+class EventCore(object):
+    """ The discrete event simulation of a State, mixed in before it. The
+    arrivals of the input are merged with the priority queue of the
+    releases of the machines: the machines are released in time order up
+    to an arrival, which gets its machine right away, so the jobs never
+    wait in the jobs heaps. The rules and so the bills are those of the
+    State. """
+
+    EVENT_POOL = EventPool
+
+    def __init__(self, *args, **kwargs):
+        super(EventCore, self).__init__(*args, **kwargs)
+        self.queue = EventQueue()
+        self.horizon = 0
+        self.machines = dict((category, self.EVENT_POOL(self.queue)) for category in self.CATEGORIES)
+
+    def release(self, time):
+        """ Releases the machines free by time. """
+        for release, (pool, machine) in self.queue.due(time):
+            pool.release(machine, release)
+        # Everything up to the latest arrival is released, an input going
+        # back in time is answered by the scan of the pools.
+        if time > self.horizon:
+            self.horizon = time
+            for pool in self.machines.values():
+                pool.horizon = time
+
+
+class EventState(EventCore, SpringState):
+    """ The event core of the spring rules. A job can take a machine free
+    by its arrival plus MAX_QUEUE_TIME, so an arrival comes at that time,
+    after the releases of the same time. """
+
+    def receive(self, event):
+        self.release(event.timestamp + self.MAX_QUEUE_TIME)
+        self.now = event.timestamp
+        if isinstance(event, Job):
+            self.dispatch(event)
+        elif isinstance(event, Command):
+            if event.cmd == 'launch':
+                self.launch(Machine(event.timestamp), event.category)
+            elif event.cmd == 'terminate':
+                closest = self.machines[event.category].closest_to_billing(self.now)
+                if closest is not None:
+                    self.terminate(closest, event.category)
+
+
+class FallEventState(EventCore, FallState):
+    """ The event core of the fall rules. The waiting machines of a job are
+    indexed in the pools up to its own arrival, so an arrival comes at its
+    time, after the releases of the same time. """
+
+    EVENT_POOL = RateEventPool
+
+    def receive(self, event):
+        self.release(event.timestamp)
+        self.now = event.timestamp
+        if isinstance(event, Job):
+            self.dispatch(event)
+        elif isinstance(event, Command):
+            if event.cmd == 'launch':
+                self.launch(Machine(event.timestamp), event.category)
+            elif event.cmd == 'terminate':
+                closest = self.machines[event.category].closest_to_billing(self.now)
+                if closest is not None:
+                    self.terminate(closest, event.category)
+
+
+class BatchBill(object):
+    """ The machine lifetimes and job overruns of a run, recorded in arrays
+    to be billed in a single pass at the end. The pass computes what
+    State.bill_it and State.calculate_penalty would, with NumPy when it is
+    installed and in a Python loop otherwise, with the same float
+    operations, so the totals are the same integers. """
+
+    def __init__(self, categories):
+        self.categories = categories
+        self.codes = dict((category, code) for code, category in enumerate(categories))
+        self.clear()
+
+    def clear(self):
+        self.machine_codes = array.array('B')
+        self.running_since = array.array('d')
+        self.stops = array.array('d')
+        self.job_codes = array.array('B')
+        self.overruns = array.array('d')
+
+    def machine(self, category, running_since, stops):
+        self.machine_codes.append(self.codes[category])
+        self.running_since.append(running_since)
+        self.stops.append(stops)
+
+    def overrun(self, category, overrun):
+        self.job_codes.append(self.codes[category])
+        self.overruns.append(overrun)
+
+    def hours(self, trial, unit):
+        """ The hours billed for the machines recorded, by category. """
+        numpy = import_numpy()
+        if numpy is None or not self.stops:
+            totals = dict.fromkeys(self.categories, 0)
+            for code, since, stops in itertools.izip(self.machine_codes, self.running_since, self.stops):
+                end = max(trial, stops + abs((stops - since) % -unit))
+                totals[self.categories[code]] += int(math.ceil(float(end - max(trial, since)) / unit))
+            return totals
+        codes = numpy.frombuffer(self.machine_codes, numpy.uint8)
+        since = numpy.frombuffer(self.running_since)
+        stops = numpy.frombuffer(self.stops)
+        end = numpy.maximum(trial, stops + numpy.abs(numpy.mod(stops - since, -unit)))
+        hours = numpy.ceil((end - numpy.maximum(trial, since)) / unit).astype(numpy.int64)
+        return dict((category, int(hours[codes == code].sum())) for code, category in enumerate(self.categories))
+
+    def penalties(self, free_time, max_time):
+        """ The penalties of the job overruns recorded, by category. """
+        numpy = import_numpy()
+        if numpy is None or not self.overruns:
+            totals = dict.fromkeys(self.categories, 0)
+            for code, overrun in itertools.izip(self.job_codes, self.overruns):
+                totals[self.categories[code]] += max(int(math.ceil(3.0 * (overrun - free_time) / max_time)), 0)
+            return totals
+        codes = numpy.frombuffer(self.job_codes, numpy.uint8)
+        overruns = numpy.frombuffer(self.overruns)
+        penalties = numpy.maximum(numpy.ceil(3.0 * (overruns - free_time) / max_time).astype(numpy.int64), 0)
+        return dict((category, int(penalties[codes == code].sum())) for code, category in enumerate(self.categories))
+
+
+def import_numpy():
+    """ NumPy is optional, and imported only when a batch bill is settled. """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class Stats(object):
+    """ Counters and phase timings of a run, collected when instrument()
+    is asked for. The timings are inclusive: receive holds the
+    process_events it runs, evaluate the bills of the machines it
+    terminates. """
+
+    PHASES = ['read_events', 'receive', 'process_events', 'bill', 'evaluate']
+
+    def __init__(self, fd=sys.stderr, progress=None):
+        self.fd = fd
+        self.progress = progress
+        self.state = None
+        self.started = time.time()
+        self.seconds = dict((phase, 0.0) for phase in self.PHASES)
+        self.calls = dict((phase, 0) for phase in self.PHASES)
+        self.events = 0
+        self.jobs = {}
+        self.commands = {}
+        self.largest_queue = {}
+        self.terminations = 0
+
+    def timed(self, phase, function):
+        seconds, calls = self.seconds, self.calls
+
+        def timed(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                seconds[phase] += time.time() - start
+                calls[phase] += 1
+        return timed
+
+    def read_events(self, events):
+        """ Yields the events, timing their reading, and writes a progress
+        line every progress events. """
+        events = iter(events)
+        while True:
+            start = time.time()
+            try:
+                event = next(events)
+            except StopIteration:
+                break
+            finally:
+                self.seconds['read_events'] += time.time() - start
+            self.events += 1
+            self.calls['read_events'] += 1
+            if self.progress and self.events % self.progress == 0:
+                self.write_progress(event)
+            yield event
+
+    def scanned(self):
+        return sum(pool.scanned for pool in self.state.machines.values())
+
+    def write_progress(self, event):
+        elapsed = time.time() - self.started
+        machines = sum(len(pool) for pool in self.state.machines.values())
+        self.fd.write('progress: %d events %.0f/s, at %d, %d machines, %d billed\n' % (
+            self.events, self.events / elapsed if elapsed else 0, event.timestamp, machines, self.state.billed))
+
+    def report(self):
+        write = self.fd.write
+        write('%-16s %10s %10s\n' % ('phase', 'calls', 'seconds'))
+        for phase in self.PHASES:
+            write('%-16s %10d %10.3f\n' % (phase, self.calls[phase], self.seconds[phase]))
+        write('total %.3f seconds\n' % (time.time() - self.started))
+        for name, counts in [('jobs', self.jobs), ('commands', self.commands),
+                             ('largest queue', self.largest_queue)]:
+            write('%s: %s\n' % (name, ' '.join('%s=%d' % item for item in sorted(counts.items()))))
+        dispatched = sum(self.jobs.values())
+        write('terminations: %d\n' % self.terminations)
+        if self.state.billed_by_category:
+            write('billed: %s\n' % ' '.join('%s=%d' % item for item in sorted(self.state.billed_by_category.items())))
+        write('machines scanned: %d, %.2f per job\n' % (self.scanned(), float(self.scanned()) / (dispatched or 1)))
+
+
+def instrument(state, stats):
+    """ Makes the state count and time its work into stats. The methods
+    are wrapped on the instance only, an uninstrumented State pays
+    nothing for it. """
+    stats.state = state
+    receive = stats.timed('receive', state.receive)
+    process_events = stats.timed('process_events', state.process_events)
+    terminate = state.terminate
+
+    def counting_receive(event):
+        if isinstance(event, Job):
+            stats.jobs[event.category] = stats.jobs.get(event.category, 0) + 1
+        else:
+            stats.commands[event.cmd] = stats.commands.get(event.cmd, 0) + 1
+        return receive(event)
+
+    def measuring_process_events(category):
+        queue = len(state.jobs[category])
+        if queue > stats.largest_queue.get(category, 0):
+            stats.largest_queue[category] = queue
+        return process_events(category)
+
+    def counting_terminate(machine, category):
+        stats.terminations += 1
+        return terminate(machine, category)
+
+    state.receive = counting_receive
+    state.process_events = measuring_process_events
+    state.terminate = counting_terminate
+    state.bill = stats.timed('bill', state.bill)
+    state.evaluate = stats.timed('evaluate', state.evaluate)
+    return state
+
+
+class WaitSketch(object):
+    """ Counts the queue waits in fixed bins, zero and then bins 10% wider
+    than the one before from a millisecond up, so it takes the same memory
+    however many waits it sees. A percentile is the upper bound of its
+    bin, within 10% of the wait. """
+
+    BOUNDS = [0.0] + [0.001 * 1.1 ** i for i in range(200)]
+
+    __slots__ = ('counts', 'count', 'largest')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.largest = 0.0
+
+    def add(self, wait):
+        i = bisect.bisect_left(self.BOUNDS, wait)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        if wait > self.largest:
+            self.largest = wait
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100.0)
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                return min(self.BOUNDS[i] if i < len(self.BOUNDS) else self.largest, self.largest)
+        return self.largest
+
+
+class HourTotals(object):
+    """ The totals of a category in an hour of simulated time. """
+
+    __slots__ = ('billed', 'machine_seconds', 'busy_seconds', 'jobs', 'waits', 'penalties', 'penalty_hours')
+
+    def __init__(self):
+        self.billed = 0
+        self.machine_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.jobs = 0
+        self.waits = WaitSketch()
+        self.penalties = 0
+        self.penalty_hours = 0
+
+
+class Report(object):
+    """ Keeps running totals per hour of simulated time and category, and
+    writes the row of an hour to fd as CSV or JSON lines once the input
+    has moved an hour past it, so only the hours still open are kept.
+
+    billed    -- hours billed for the machines terminated in the hour
+    machine_seconds -- seconds the machines ran, booting and after a
+                 terminate until their last job ended included
+    busy_seconds, idle_seconds -- the part of those running jobs, and not
+    jobs, wait_p50, wait_p90, wait_p99, wait_max -- the jobs which started
+                 in the hour and their seconds in the queue
+    penalties, penalty_hours -- the penalized jobs and their billed penalty
+    """
+
+    HOUR = 3600
+    COLUMNS = ['hour', 'category', 'billed', 'machine_seconds', 'busy_seconds', 'idle_seconds', 'jobs',
+               'wait_p50', 'wait_p90', 'wait_p99', 'wait_max', 'penalties', 'penalty_hours']
+
+    def __init__(self, fd, fmt='csv'):
+        import json
+        self.fd = fd
+        self.fmt = fmt
+        self.hours = {}
+        self.running = {}
+        self.accrued = None
+        self.flushed = None
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+        if fmt == 'csv':
+            self.fd.write(','.join(self.COLUMNS) + '\n')
+
+    def totals(self, hour, category):
+        key = (hour, category)
+        totals = self.hours.get(key)
+        if totals is None:
+            totals = self.hours[key] = HourTotals()
+        return totals
+
+    def spread(self, category, start, end, field, count=1):
+        """ Adds count times the seconds from start to end to the field of
+        the hours they fall in. """
+        while start < end:
+            hour = int(start // self.HOUR) * self.HOUR
+            until = min(end, hour + self.HOUR)
+            totals = self.totals(hour, category)
+            setattr(totals, field, getattr(totals, field) + count * (until - start))
+            start = until
+
+    def advance(self, now):
+        """ Counts the running machines up to now, and writes the hours the
+        input has moved past. """
+        if self.accrued is None:
+            self.accrued = now
+        if now > self.accrued:
+            for category, count in self.running.items():
+                if count:
+                    self.spread(category, self.accrued, now, 'machine_seconds', count)
+            self.accrued = now
+        hour = int(now // self.HOUR) * self.HOUR - self.HOUR
+        if self.flushed is None or hour > self.flushed:
+            self.flush(hour)
+            self.flushed = hour
+
+    def launched(self, category):
+        self.running[category] = self.running.get(category, 0) + 1
+
+    def terminated(self, category, now, stops, billed):
+        self.running[category] -= 1
+        # A terminated machine still runs its last job, and is billed for it.
+        self.spread(category, now, stops, 'machine_seconds')
+        self.totals(int(now // self.HOUR) * self.HOUR, category).billed += billed
+
+    def job(self, category, timestamp, start, end):
+        totals = self.totals(int(start // self.HOUR) * self.HOUR, category)
+        totals.jobs += 1
+        totals.waits.add(max(start - timestamp, 0.0))
+        self.spread(category, start, end, 'busy_seconds')
+
+    def penalty(self, category, start, penalty, billed):
+        totals = self.totals(int(start // self.HOUR) * self.HOUR, category)
+        totals.penalties += 1
+        if billed:
+            totals.penalty_hours += penalty
+
+    def flush(self, before=None):
+        """ Writes and forgets the hours before the given one, all of them
+        if it is None. """
+        for key in sorted(self.hours):
+            if before is not None and key[0] >= before:
+                continue
+            totals = self.hours.pop(key)
+            waits = totals.waits
+            row = [key[0], key[1], totals.billed, round(totals.machine_seconds, 3),
+                   round(totals.busy_seconds, 3), round(totals.machine_seconds - totals.busy_seconds, 3),
+                   totals.jobs, round(waits.percentile(50), 3), round(waits.percentile(90), 3),
+                   round(waits.percentile(99), 3), round(waits.largest, 3), totals.penalties, totals.penalty_hours]
+            if self.fmt == 'csv':
+                self.fd.write(','.join(map(str, row)) + '\n')
+            else:
+                self.fd.write(self.encode(collections.OrderedDict(zip(self.COLUMNS, row))) + '\n')
+
+
+def attach_report(state, report):
+    """ Makes the state keep the report up to date. Like instrument(), it
+    wraps the methods of the instance only. """
+    receive, dispatch, launch, terminate, evaluate = (
+        state.receive, state.dispatch, state.launch, state.terminate, state.evaluate)
+    # The job being dispatched and, once it has a machine, its start.
+    current = []
+
+    def reporting_receive(event):
+        report.advance(event.timestamp)
+        return receive(event)
+
+    def reporting_dispatch(job):
+        current[:] = [job]
+        return dispatch(job)
+
+    def reporting_occupy(category, occupy):
+        def reporting_occupy(machine, busy_till):
+            occupy(machine, busy_till)
+            job = current[0]
+            current[1:] = [busy_till - job.duration]
+            report.job(category, job.timestamp, busy_till - job.duration, busy_till)
+        return reporting_occupy
+
+    def reporting_calculate_penalty(calculate_penalty):
+        def reporting_calculate_penalty(overrun):
+            penalty = calculate_penalty(overrun)
+            if penalty > 0:
+                report.penalty(current[0].category, current[1], penalty, state.now > state.trial)
+            return penalty
+        return reporting_calculate_penalty
+
+    def reporting_launch(machine, category):
+        report.launched(category)
+        return launch(machine, category)
+
+    def reporting_terminate(machine, category):
+        billed = state.billed
+        terminate(machine, category)
+        report.terminated(category, state.now, max(state.now, machine.busy_till), state.billed - billed)
+
+    def reporting_evaluate():
+        try:
+            return evaluate()
+        finally:
+            # The machines evaluate left running still finish their jobs.
+            for category, pool in state.machines.items():
+                for machine in pool:
+                    report.spread(category, state.now, machine.busy_till, 'machine_seconds')
+            report.flush()
+
+    for category, pool in state.machines.items():
+        pool.occupy = reporting_occupy(category, pool.occupy)
+    if hasattr(state, 'calculate_penalty'):
+        state.calculate_penalty = reporting_calculate_penalty(state.calculate_penalty)
+    state.receive = reporting_receive
+    state.dispatch = reporting_dispatch
+    state.launch = reporting_launch
+    state.terminate = reporting_terminate
+    state.evaluate = reporting_evaluate
+    return state
+
+
+WORD_RE = re.compile(r'\w+$')
+# read_events reads its input in blocks of this many bytes.
+READ_BLOCK_SIZE = 1 << 20
+
+
+class SpringFormat(object):
+    """ The log of the spring contest: a date and a time of day, then the
+    guid, category and elapsed seconds of a job, or a command and its
+    category. """
+
+    COMMON_RE = r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2}) (?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d) '
+    CMD_RE = re.compile(COMMON_RE + r'(?P<cmd>[^ ]+) (?P<category>\w+)')
+    JOB_RE = re.compile(COMMON_RE + r'(?P<guid>[^ ]+) (?P<category>\w+) (?P<elapsed>\d+\.\d+)')
+    DAY_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+    TIME_RE = re.compile(r'(\d\d):(\d\d):(\d\d)$')
+
+    @staticmethod
+    def parse_timestamp(data_dict):
+        import calendar
+        fields = ['year', 'month', 'day', 'hour', 'minute', 'second']
+        return calendar.timegm(map(lambda k: int(data_dict[k]), fields))
+
+    @classmethod
+    def parse_line(cls, line):
+        """ Parses a line with the regular expressions. Returns None for
+        lines which are neither jobs nor commands. """
+        m = cls.JOB_RE.match(line)
+        if m:
+            d = m.groupdict()
+            return Job(cls.parse_timestamp(d), d['category'], float(d['elapsed']), d['guid'])
+        m = cls.CMD_RE.match(line)
+        if m:
+            d = m.groupdict()
+            return Command(cls.parse_timestamp(d), d['category'], d['cmd'])
+
+    @classmethod
+    def day_start(cls, day):
+        """ The timestamp of midnight of a YYYY-MM-DD day, None if malformed.
+        A day which does not exist is malformed too: parse_line decides what
+        its line is, as it does on the regex path. """
+        import calendar
+        m = cls.DAY_RE.match(day)
+        if m:
+            try:
+                return calendar.timegm(map(int, m.groups()) + [0, 0, 0])
+            except ValueError:
+                return None
+
+    @classmethod
+    def seconds_of_day(cls, time):
+        """ The seconds since midnight of a HH:MM:SS time, None if malformed. """
+        m = cls.TIME_RE.match(time)
+        if m:
+            hour, minute, second = map(int, m.groups())
+            return (hour * 60 + minute) * 60 + second
+
+    @classmethod
+    def parse_lines(cls, blocks):
+        """ Yields the events of lists of lines. Whether the line is a job
+        is told by its fifth token. The timestamp is the sum of two cached
+        values: the start of the day and the seconds of the time of day.
+        Lines of any other shape are left to parse_line. """
+        days = {}
+        times = {}
+        words = {}
+        for lines in blocks:
+            for line in lines:
+                fields = line.split(' ')
+                if len(fields) == 5 and fields[4]:
+                    day, time, guid, category, elapsed = fields
+                    whole, dot, fraction = elapsed.partition('.')
+                    valid = guid and dot and whole.isdigit() and fraction.isdigit()
+                    cmd = None
+                elif len(fields) == 4 or len(fields) == 5:
+                    day, time, cmd, category = fields[:4]
+                    valid = cmd
+                else:
+                    valid = False
+                if valid:
+                    if day not in days:
+                        days[day] = cls.day_start(day)
+                    if time not in times:
+                        times[time] = cls.seconds_of_day(time)
+                    if category not in words:
+                        words[category] = WORD_RE.match(category) is not None
+                    valid = days[day] is not None and times[time] is not None and words[category]
+                if not valid:
+                    event = cls.parse_line(line)
+                    if event is not None:
+                        yield event
+                elif cmd is None:
+                    yield Job(days[day] + times[time], category, float(elapsed), guid)
+                else:
+                    yield Command(days[day] + times[time], category, cmd)
+
+
+class FallFormat(object):
+    """ The log of the fall contest: a unix timestamp, then the duration,
+    guid and category of a job, or a command and its category. """
+
+    COMMON_RE = r'^(?P<timestamp>\d+) '
+    CMD_RE = re.compile(COMMON_RE + r'(?P<cmd>[^ ]+) (?P<category>\w+)\s*$')
+    JOB_RE = re.compile(COMMON_RE + r'(?P<duration>\d+\.\d+) (?P<guid>[^ ]+) (?P<category>\w+)\s*$')
+
+    @classmethod
+    def parse_line(cls, line):
+        """ Parses a line with the regular expressions. Returns None for
+        lines which are neither jobs nor commands. """
+        m = cls.JOB_RE.match(line)
+        if m:
+            d = m.groupdict()
+            return Job(int(d['timestamp']), d['category'], float(d['duration']), d['guid'])
+        m = cls.CMD_RE.match(line)
+        if m:
+            d = m.groupdict()
+            return Command(int(d['timestamp']), d['category'], d['cmd'])
+
+    @classmethod
+    def parse_lines(cls, blocks):
+        """ Yields the events of lists of lines. Whether the line is a job
+        is told by its fourth token. Lines of any other shape are left to
+        parse_line. """
+        words = {}
+        for lines in blocks:
+            for line in lines:
+                fields = line.split(' ')
+                if len(fields) == 4:
+                    timestamp, duration, guid, category = fields
+                    whole, dot, fraction = duration.partition('.')
+                    valid = guid and dot and whole.isdigit() and fraction.isdigit()
+                elif len(fields) == 3:
+                    timestamp, cmd, category = fields
+                    valid = cmd
+                    duration = None
+                else:
+                    valid = False
+                if valid:
+                    if category not in words:
+                        words[category] = WORD_RE.match(category) is not None
+                    valid = words[category] and timestamp.isdigit()
+                if not valid:
+                    event = cls.parse_line(line)
+                    if event is not None:
+                        yield event
+                elif duration is None:
+                    yield Command(int(timestamp), category, cmd)
+                else:
+                    yield Job(int(timestamp), category, float(duration), guid)
+
+
+# The rule sets and the log formats of the contests, by name.
+RULES = {
+    'spring': (SpringState, SpringFormat),
+    'fall': (FallState, FallFormat),
+}
+
+
+def read_events_re(fd, fmt):
+    """ The reference parser: a readline and up to two regex matches per line. """
+    while True:
+        line = fd.readline()
+        if not line:
+            break
+        event = fmt.parse_line(line)
+        if event is not None:
+            yield event
+
+
+def read_lines(fd, block_size=READ_BLOCK_SIZE, head=''):
+    """ Yields the lines of fd, without the newline, in lists holding a
+    block of block_size bytes each. head is text to take before fd. """
+    tail = head
+    while True:
+        block = fd.read(block_size)
+        if not block:
+            break
+        lines = (tail + block).split('\n')
+        tail = lines.pop()
+        yield lines
+    if tail:
+        yield [tail]
+
+
+class DecompressingReader(object):
+    """ Reads a compressed file, decompressing it in a separate thread.
+    The thread stays at most `depth` blocks ahead of the reader, read()
+    returns the next decompressed block and '' at the end. close() stops
+    the thread, which closes the file. """
+
+    # The thread waiting for room on the queue checks this often whether
+    # the reader was closed, in seconds.
+    POLL = 0.1
+
+    def __init__(self, path, new_decompressor, depth=8, block_size=READ_BLOCK_SIZE):
+        import Queue
+        import threading
+        self.blocks = Queue.Queue(depth)
+        self.done = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.decompress, args=(path, new_decompressor, block_size))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def decompress(self, path, new_decompressor, block_size):
+        try:
+            with open(path, 'rb') as fd:
+                decompressor = new_decompressor()
+                for data in iter(lambda: fd.read(block_size), ''):
+                    while data:
+                        try:
+                            block = decompressor.decompress(data)
+                        except EOFError:
+                            # The stream ended exactly at the end of the
+                            # block before, the data starts the next one.
+                            decompressor = new_decompressor()
+                            continue
+                        # A file may hold several streams, like pbzip2 writes.
+                        data = decompressor.unused_data
+                        if data:
+                            decompressor = new_decompressor()
+                        if block and not self.put(block):
+                            return
+            self.put('')
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        """ Puts the item on the queue, unless the reader is closed first.
+        Returns whether it did. """
+        import Queue
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout=self.POLL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def read(self, size=-1):
+        if self.done:
+            return ''
+        block = self.blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        self.done = not block
+        return block
+
+    def drain(self):
+        import Queue
+        while True:
+            try:
+                self.blocks.get_nowait()
+            except Queue.Empty:
+                return
+
+    def close(self):
+        """ Stops the thread and drops the blocks it decompressed. """
+        self.done = True
+        self.stopped.set()
+        # A thread waiting for room puts its block and then sees the stop.
+        self.drain()
+        self.thread.join()
+        self.drain()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def import_lzma():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise IOError('reading .xz files needs the lzma module (backports.lzma)')
+    return lzma
+
+
+def open_input(path):
+    """ Opens an input file, decompressing .bz2, .gz and .xz files on the fly.
+    The module of a decompressor is imported only to read a file it is for. """
+    if path.endswith('.bz2'):
+        import bz2
+        return DecompressingReader(path, bz2.BZ2Decompressor)
+    if path.endswith('.gz'):
+        import zlib
+        return DecompressingReader(path, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+    if path.endswith('.xz'):
+        return DecompressingReader(path, import_lzma().LZMADecompressor)
+    return open(path)
+
+
+def read_events(fd, fmt, block_size=READ_BLOCK_SIZE):
+    """ Yields the same events as read_events_re, but reads the input in
+    large blocks and splits every line once. """
+    return fmt.parse_lines(read_lines(fd, block_size))
+
+
+# Compiled event files start with this, followed by a JSON header line.
+EVENTS_MAGIC = 'SCEVENTS'
+# Events are compiled and loaded in chunks of this many.
+EVENTS_CHUNK = 1 << 16
+# The columns of a compiled event file: name, struct format of an item.
+EVENTS_COLUMNS = [
+    ('timestamp', 'q'),
+    ('duration', 'd'),
+    ('category', 'B'),
+    ('command', 'B'),
+    ('guid_end', 'Q'),
+]
+
+
+def compile_events(events, path):
+    """ Writes the events to a columnar file, which read_compiled_events
+    loads without parsing any text.
+
+    The file starts with EVENTS_MAGIC and a JSON header line holding the
+    number of events, the category and command names and the offset of
+    every column from the end of the header line. The columns are little
+    endian arrays of the timestamps, the durations (0 for commands), the
+    category codes, the command codes (0 for jobs, 1 + the index of the
+    command name otherwise) and the end offsets of the guids in the last
+    column, which holds the guids of the jobs one after the other. """
+    import json
+    import shutil
+    import tempfile
+    names = {'category': [], 'command': []}
+    codes = {'category': {}, 'command': {}}
+    files = dict((name, tempfile.TemporaryFile()) for name, _ in EVENTS_COLUMNS + [('guid', None)])
+
+    def code(kind, name, first):
+        if name not in codes[kind]:
+            if first + len(names[kind]) > 255:
+                raise ValueError('too many %s names for a compiled event file' % kind)
+            codes[kind][name] = first + len(names[kind])
+            names[kind].append(name)
+        return codes[kind][name]
+
+    count = 0
+    guid_end = 0
+    events = iter(events)
+    for chunk in iter(lambda: list(itertools.islice(events, EVENTS_CHUNK)), []):
+        columns = dict((name, []) for name, _ in EVENTS_COLUMNS)
+        guids = []
+        for event in chunk:
+            columns['timestamp'].append(event.timestamp)
+            columns['category'].append(code('category', event.category, 0))
+            if isinstance(event, Job):
+                columns['duration'].append(event.duration)
+                columns['command'].append(0)
+                guids.append(event.guid)
+                guid_end += len(event.guid)
+            else:
+                columns['duration'].append(0.0)
+                columns['command'].append(code('command', event.cmd, 1))
+            columns['guid_end'].append(guid_end)
+        for name, item in EVENTS_COLUMNS:
+            files[name].write(struct.pack('<%d%s' % (len(chunk), item), *columns[name]))
+        files['guid'].write(''.join(guids))
+        count += len(chunk)
+    offsets = {}
+    offset = 0
+    for name, _ in EVENTS_COLUMNS + [('guid', None)]:
+        offsets[name] = offset
+        offset += files[name].tell()
+    header = {'events': count, 'categories': names['category'], 'commands': names['command'], 'offsets': offsets}
+    with open(path, 'wb') as fd:
+        fd.write('%s %s\n' % (EVENTS_MAGIC, json.dumps(header)))
+        for name, _ in EVENTS_COLUMNS + [('guid', None)]:
+            files[name].seek(0)
+            shutil.copyfileobj(files[name], fd)
+            files[name].close()
+
+
+def is_compiled(path):
+    """ Tells whether the file was written by compile_events. """
+    with open(path, 'rb') as fd:
+        return fd.read(len(EVENTS_MAGIC)) == EVENTS_MAGIC
+
+
+def read_compiled_events(path, first=0):
+    """ Yields the events of a file written by compile_events, from the
+    first-th one on. The file is mapped into memory and its columns are
+    unpacked a chunk at a time. """
+    import json
+    import mmap
+    with open(path, 'rb') as fd:
+        header = json.loads(fd.readline()[len(EVENTS_MAGIC):])
+        base = fd.tell()
+        data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    categories = [str(name) for name in header['categories']]
+    commands = [None] + [str(name) for name in header['commands']]
+    offsets = dict((name, base + offset) for name, offset in header['offsets'].items())
+    try:
+        guid_start = offsets['guid']
+        if first:
+            guid_start += struct.unpack_from('<Q', data, offsets['guid_end'] + (first - 1) * struct.calcsize('Q'))[0]
+        for start in xrange(first, header['events'], EVENTS_CHUNK):
+            n = min(EVENTS_CHUNK, header['events'] - start)
+            timestamps, durations, category_codes, command_codes, guid_ends = [
+                struct.unpack_from('<%d%s' % (n, item), data, offsets[name] + start * struct.calcsize(item))
+                for name, item in EVENTS_COLUMNS]
+            for i in xrange(n):
+                if command_codes[i]:
+                    yield Command(timestamps[i], categories[category_codes[i]], commands[command_codes[i]])
+                else:
+                    guid_end = offsets['guid'] + guid_ends[i]
+                    yield Job(timestamps[i], categories[category_codes[i]], durations[i], data[guid_start:guid_end])
+                    guid_start = guid_end
+    finally:
+        data.close()
+
+
+def read_file_events(path, fmt):
+    """ Yields the events of a log file of the format, compressed or not,
+    or of a file written by compile_events. """
+    if is_compiled(path):
+        for event in read_compiled_events(path):
+            yield event
+    else:
+        with open_input(path) as fd:
+            for event in read_events(fd, fmt):
+                yield event
+
+
+def set_logger(stream):
+    """ Prints the traces to the stream. """
+    import logging
+    logging.basicConfig(stream=stream, level=logging.DEBUG)
+    WithLog.log = logging.getLogger('prezi.com')
@@ -19,220 +19,715 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
-import argparse
-import calendar
-import heapq
-import logging
-import math
-import random
-import re
+import itertools
+import os
 import sys
-import uuid
+import time
 
+import engine
+from engine import (EVENTS_CHUNK, READ_BLOCK_SIZE, Command, EventState, Job, Report, SpringFormat, SpringState,
+                    Stats, Strategy, TraceSink, attach_report, compile_events, instrument, is_compiled, open_input,
+                    read_compiled_events, read_lines)
 
-class Event(object):
-    def __init__(self, data_dict):
-        fields = ['year', 'month', 'day', 'hour', 'minute', 'second']
-        self.timestamp = calendar.timegm(map(lambda k: int(data_dict[k]), fields))
+# The rules and the log format of the spring contest.
+State = SpringState
+FORMAT = SpringFormat
+parse_line = FORMAT.parse_line
+parse_lines = FORMAT.parse_lines
 
-    def __cmp__(self, other):
-        return cmp(self.timestamp, other.timestamp)
 
+def read_events_re(fd):
+    return engine.read_events_re(fd, FORMAT)
 
-class Job(Event):
-    def __init__(self, data_dict):
-        super(Job, self).__init__(data_dict)
-        self.category = data_dict['category']
-        self.elapsed = float(data_dict['elapsed'])
-        self.guid = data_dict['guid']
 
+def read_events(fd, block_size=READ_BLOCK_SIZE):
+    return engine.read_events(fd, FORMAT, block_size)
 
-class Command(Event):
-    def __init__(self, data_dict):
-        super(Command, self).__init__(data_dict)
-        self.category = data_dict['category']
-        self.cmd = data_dict['cmd']
 
+def read_file_events(path):
+    return engine.read_file_events(path, FORMAT)
 
-class Machine(object):
-    # VMs are billed by the hour (3600 seconds).
-    BILLING_UNIT = 3600
-    # Boot time is 2 minutes (120 seconds).
-    MACHINE_INACTIVE = 120
 
-    def __init__(self, booted, world):
-        self.active_from = booted + self.MACHINE_INACTIVE
-        # busy_till specifies when the job currently processed by the
-        # node will end (if any).
-        self.busy_till = 0
-        self.world = world
-        self.terminated = False
-        self.guid = str(uuid.uuid1())
+class InputReader(object):
+    """ Yields the events of a log, compressed or not, or of a compiled
+    event file from a position: the byte offset of a line of the log or
+    the index of an event in the compiled file. A path of None stands for
+    the standard input.
 
-    def __cmp__(self, other):
-        now = self.world.now
-        return cmp(self.till_billing(now), other.till_billing(now))
-
-    @property
-    def running_since(self):
-        return self.active_from - self.MACHINE_INACTIVE
-
-    def till_billing(self, now):
-        return abs((now - self.running_since) % -self.BILLING_UNIT)
-
-    def is_active(self, now):
-        return now >= self.active_from and self.busy_till <= now
-
-
-class WithLog(object):
-    log = logging.getLogger('prezi.com')
-
-    def info(self, *args):
-        self.log.info(*args)
+    The events are read a block at a time and position is moved past a
+    block when the event after it is asked for, so the events received
+    before that one are exactly the events before position. done is set
+    once the last event was passed. """
 
+    def __init__(self, path=None, position=0, block_size=READ_BLOCK_SIZE):
+        self.path = path
+        self.position = position
+        self.block_size = block_size
+        self.done = False
 
-class State(WithLog):
+    def __iter__(self):
+        if self.path is not None and is_compiled(self.path):
+            events = read_compiled_events(self.path, self.position)
+            for chunk in iter(lambda: list(itertools.islice(events, EVENTS_CHUNK)), []):
+                for event in chunk:
+                    yield event
+                self.position += len(chunk)
+        else:
+            with open_input(self.path) if self.path is not None else sys.stdin as fd:
+                head = skip_input(fd, self.position)
+                for lines in read_lines(fd, self.block_size, head):
+                    for event in parse_lines([lines]):
+                        yield event
+                    self.position += sum(map(len, lines)) + len(lines)
+        self.done = True
+
+
+def skip_input(fd, size):
+    """ Moves fd size bytes forward, reading them if it cannot seek.
+    Returns the text read past them, as a reader may return more than
+    asked for. """
+    try:
+        fd.seek(size, 1)
+        return ''
+    except (AttributeError, IOError):
+        while size > 0:
+            block = fd.read(min(size, READ_BLOCK_SIZE))
+            if not block:
+                break
+            size -= len(block)
+        return block[len(block) + size:] if size < 0 else ''
+
+
+def handles_jobs(strategy):
+    return type(strategy).on_job.im_func is not Strategy.on_job.im_func
+
+
+def run_strategy(strategy, events, started=False):
+    """ Yields the events with the commands of the strategy among them, in
+    the order the text protocol would carry them. A strategy which has
+    started already, as one resumed from a snapshot, is not started again. """
+    last = None
+    on_job = handles_jobs(strategy)
+    for event in events:
+        if last is None and not started:
+            for cmd, category in strategy.start(event):
+                yield Command(event.timestamp, category, cmd)
+        yield event
+        if on_job and isinstance(event, Job):
+            for cmd, category in strategy.on_job(event):
+                yield Command(event.timestamp, category, cmd)
+        last = event
+    if last is not None:
+        for cmd, category in strategy.finish(last):
+            yield Command(last.timestamp, category, cmd)
+
+
+def format_commands(timestamp, commands):
+    date_time = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+    return ''.join('%s %s %s\n' % (date_time, cmd, category) for cmd, category in commands)
+
+
+def pipe_strategy(strategy, fd_in, fd_out, block_size=READ_BLOCK_SIZE):
+    """ Runs the strategy as a competitor of the text protocol: copies the
+    log from fd_in to fd_out and adds the lines of its commands. Only the
+    first and the last event are parsed unless the strategy looks at the
+    jobs. """
+    if not handles_jobs(strategy):
+        copy_strategy(strategy, fd_in, fd_out, block_size)
+        return
+    first = last = None
+    for lines in read_lines(fd_in, block_size):
+        out = []
+        for line in lines:
+            event = parse_line(line)
+            if event is not None:
+                if first is None:
+                    first = event
+                    out.append(format_commands(event.timestamp, strategy.start(event)))
+                out.append(line + '\n')
+                if isinstance(event, Job):
+                    out.append(format_commands(event.timestamp, strategy.on_job(event)))
+                last = event
+                continue
+            out.append(line + '\n')
+        fd_out.write(''.join(out))
+    if last is not None:
+        fd_out.write(format_commands(last.timestamp, strategy.finish(last)))
+
+
+def last_event(text, end):
+    """ The last event among the lines of text up to the newline at end,
+    None if there is none. """
+    while end >= 0:
+        start = text.rfind('\n', 0, end) + 1
+        event = parse_line(text[start:end])
+        if event is not None:
+            return event
+        end = start - 1
+    return None
+
+
+def copy_strategy(strategy, fd_in, fd_out, block_size=READ_BLOCK_SIZE):
+    """ pipe_strategy of a strategy which does not look at the jobs. The
+    lines are parsed up to the first event, the rest of the log is copied
+    block by block as it is read, parsing only the last event of every
+    block. """
+    blocks = iter(lambda: fd_in.read(block_size), '')
+    text = ''
+    start = 0
+    first = None
+    for block in blocks:
+        text += block
+        end = text.find('\n', start)
+        while end >= 0:
+            first = parse_line(text[start:end])
+            if first is not None:
+                break
+            start = end + 1
+            end = text.find('\n', start)
+        if first is not None:
+            break
+    else:
+        # The last line of a log need not end in a newline.
+        first = parse_line(text[start:])
+    if first is None:
+        fd_out.write(text)
+        return
+    fd_out.write(text[:start])
+    fd_out.write(format_commands(first.timestamp, strategy.start(first)))
+    last = first
+    tail = ''
+    for block in itertools.chain([text[start:]], blocks):
+        fd_out.write(block)
+        text = tail + block
+        end = text.rfind('\n')
+        event = last_event(text, end)
+        if event is not None:
+            last = event
+        tail = text[end + 1:]
+    if tail:
+        fd_out.write('\n')
+        last = parse_line(tail) or last
+    fd_out.write(format_commands(last.timestamp, strategy.finish(last)))
+
+
+def load_strategy(name, parameters=None):
+    """ Creates the strategy named as module:Class, passing the parameters
+    to the class as keyword arguments. """
+    import importlib
+    module, _, cls = name.partition(':')
+    return getattr(importlib.import_module(module), cls)(**(parameters or {}))
+
+
+def sweep_worker(task):
+    """ Evaluates the strategy with a single parameter set of a sweep. """
+    path, strategy, parameters, seed = task
+    state = State(seed=seed)
+    for event in run_strategy(load_strategy(strategy, parameters), read_compiled_events(path)):
+        state.receive(event)
+        if state.overwait:
+            break
+    return parameters, state.evaluate(), state.overwait
+
+
+def parse_value(text):
+    import json
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_sweep(specs):
+    """ Makes the parameter sets of NAME=VALUE,VALUE,... specifications:
+    every combination of their values. """
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        axes.append([(name, parse_value(value)) for value in values.split(',')])
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def evaluate_sweep(path, strategy, parameter_sets, seed=None, processes=None):
+    """ Evaluates the strategy with every parameter set in a pool of
+    processes, and yields (parameters, bill, overwait) in the order of the
+    parameter sets.
+
+    The log is parsed only once, into a compiled event file which every
+    worker maps, unless it is a compiled event file already. A path of
+    None stands for the standard input. """
+    import multiprocessing
+    import tempfile
+    compiled = None
+    if path is None or not is_compiled(path):
+        handle, compiled = tempfile.mkstemp(suffix='.events')
+        os.close(handle)
+        compile_events(read_file_events(path) if path else read_events(sys.stdin), compiled)
+        path = compiled
+    pool = multiprocessing.Pool(processes)
+    try:
+        tasks = [(path, strategy, parameters, seed) for parameters in parameter_sets]
+        for result in pool.imap(sweep_worker, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        if compiled:
+            os.remove(compiled)
+
+
+def save_snapshot(path, snapshot):
+    """ Pickles the snapshot to path, replacing the file only when it is
+    complete. """
+    import cPickle
+    import tempfile
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(handle, 'wb') as fd:
+        cPickle.dump(snapshot, fd, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temporary, path)
+
+
+def load_snapshot(path):
+    """ Unpickles a snapshot. The classes of this module are taken from
+    this module, whether the script or an importer of the module saved
+    the snapshot, and those which moved to the engine from the engine. """
+    import cPickle
+
+    def find_global(module, name):
+        if module in ('__main__', 'evaluator'):
+            return globals()[name] if name in globals() else getattr(engine, name)
+        __import__(module)
+        return getattr(sys.modules[module], name)
+
+    with open(path, 'rb') as fd:
+        unpickler = cPickle.Unpickler(fd)
+        unpickler.find_global = find_global
+        return unpickler.load()
+
+
+def run_checkpointed(state, reader, strategy=None, started=False, events=0,
+                     checkpoint=None, every_events=None, every_seconds=None):
+    """ Feeds the events of the reader, with the commands of the strategy
+    if there is one, to the state, and returns the number of events it
+    received in all.
+
+    At the end of the first input block after every_events events or
+    every_seconds seconds of simulated time a snapshot of the run is
+    written to checkpoint, formatted with the events received so far and
+    the simulated time: a name like 'run-{events}.snapshot' keeps them all.
+    The snapshot holds the state, the strategy, the input and its position
+    and the number of events; resume it with a new State.receive loop, or
+    with --resume. """
+    source = iter(reader)
+    stream = run_strategy(strategy, source, started) if strategy is not None else source
+    position = reader.position
+    last_events, last_time = events, state.now or None
+    for event in stream:
+        if reader.position != position:
+            position = reader.position
+            # The commands the strategy issues at the end belong to the run.
+            # The simulated time is only counted from the first event on, the
+            # blocks before it may hold no event.
+            if checkpoint and not reader.done and (every_events and events - last_events >= every_events or
+                               every_seconds and last_time is not None and
+                               state.now - last_time >= every_seconds):
+                save_snapshot(checkpoint.format(events=events, time=state.now), {
+                    'state': state, 'strategy': strategy, 'events': events,
+                    'input': reader.path, 'position': position})
+                last_events, last_time = events, state.now
+        state.receive(event)
+        events += 1
+        if last_time is None:
+            last_time = state.now
+        if state.overwait:
+            break
+    return events
 
-    # TRIAL_ENDS refers to the grace period of the first 24 hours
-    # during which competitors will not be disqualified or penalized.
-    TRIAL_ENDS = 24 * 60 * 60
-    # After the grace period, 5 seconds is the maximum time a job can
-    # spend in the queue.
-    MAX_QUEUE_TIME = 5
 
-    def __init__(self):
-        self.time = 0
-        self.billed = 0
-        self.trial = None
-        self.overwait = False
-        self.jobs = {'url': [], 'general': [], 'export': []}
-        self.machines = {'url': [], 'general': [], 'export': []}
+def category_worker(category, queue, results, stop, seed, trial, trace):
+    """ Evaluates the events of a single category. The lines arrive on the
+    queue as text blocks, followed by ('end', time of the last event of the
+    whole input). Puts (category, bill, overwait, error) on results. """
+    import traceback
+    end = []
 
-    @property
-    def now(self):
-        return self.time
-
-    @now.setter
-    def now(self, value):
-        self.time = value
-        if self.trial is None:
-            self.trial = self.time + self.TRIAL_ENDS
-            self.info('trial_ends %d' % self.trial)
-
-    def receive(self, event):
-        self.now = event.timestamp
-        if isinstance(event, Job):
-            heapq.heappush(self.jobs[event.category], event)
-            self.process_events(event.category)
-        elif isinstance(event, Command):
-            self.process_events(event.category)
-            if event.cmd == 'launch':
-                self.launch(Machine(event.timestamp, self), event.category)
-            elif event.cmd == 'terminate':
-                closest = heapq.nsmallest(1, self.machines[event.category])
-                if closest:
-                    self.terminate(closest[0], event.category)
-
-    def launch(self, machine, category):
-        heapq.heappush(self.machines[category], machine)
-        self.info('launch %d %d %s' % (machine.running_since, machine.busy_till, machine.guid))
-
-    def terminate(self, machine, category):
-        machine.terminated = True
-        bill = self.bill(category=category)
-        self.info('terminate %d %d %d %s' % (machine.running_since, machine.active_from, bill, machine.guid))
-
-    def rnd_machine(self, category):
-        n = len(self.machines[category])
-        rnd_start = random.randrange(n)
-        for i in range(n):
-            yield self.machines[category][(rnd_start + i) % n]
-
-    def process_events(self, category):
-        while self.jobs[category]:
-            job = heapq.heappop(self.jobs[category])
-            self.info('job_retrieved %d %s' % (job.timestamp, job.guid))
-            for machine in self.rnd_machine(category):
-                if machine.is_active(job.timestamp + self.MAX_QUEUE_TIME):
-                    machine.busy_till = max(machine.busy_till, job.timestamp) + job.elapsed
-                    self.info('job_executed_till %d %s %s' % (machine.busy_till, job.guid, machine.guid))
-                    break
+    def blocks():
+        while not end:
+            item = queue.get()
+            if isinstance(item, tuple):
+                end.append(item[1])
             else:
-                self.info('no_machine_for %d %s' % (job.timestamp, job.guid))
-                self.overwait = job.timestamp > self.trial
-
-    def bill(self, category=None):
-        bill_previous = self.billed
-        if category:
-            all_terminated = filter(lambda m: m.terminated, self.machines[category])
-            for machine in all_terminated:
-                self.bill_it(machine)
-            for machine in all_terminated:
-                self.machines[category].remove(machine)
-        else:
-            for _, machines in self.machines.items():
-                for machine in machines:
-                    self.bill_it(machine)
-        return self.billed - bill_previous
-
-    def bill_it(self, machine):
-        """ Computes the cost of a single virtual machine. """
-        if self.now > self.trial:
-            when_stops = max(self.now, machine.busy_till)
-            billing_start = max(self.trial, machine.running_since)
-            billing_end = max(self.trial, when_stops + machine.till_billing(when_stops))
-            self.billed += int(math.ceil(float(billing_end - billing_start) / machine.BILLING_UNIT))
-
-    def evaluate(self):
-        for category in ['general', 'export', 'url']:
-            self.process_events(category)
-            for machine in self.machines[category]:
-                self.terminate(machine, category)
-            if self.overwait:
-                return -1
-        return self.billed
-
-
-def read_events(fd):
-    common = r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2}) (?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d) '
-    cmd_re = re.compile(common + r'(?P<cmd>[^ ]+) (?P<category>\w+)')
-    job_re = re.compile(common + r'(?P<guid>[^ ]+) (?P<category>\w+) (?P<elapsed>\d+\.\d+)')
-
-    while True:
-        line = fd.readline()
-        if not line:
+                yield item.split('\n')
+
+    error = None
+    bill = None
+    trace_fd = open('%s.%s' % (trace, category), 'w') if trace else None
+    state = State(TraceSink(trace_fd) if trace_fd else None, seed, trial)
+    try:
+        for event in parse_lines(blocks()):
+            state.receive(event)
+            if state.overwait:
+                break
+    except Exception:
+        error = traceback.format_exc()
+    if error or state.overwait:
+        stop.set()
+    # The rest of the input is not needed, but the queue has to be emptied.
+    for _ in blocks():
+        pass
+    if error is None:
+        if end[0] is not None and not state.overwait:
+            state.now = end[0]
+        bill = state.evaluate()
+    if trace_fd:
+        trace_fd.close()
+    results.put((category, bill, state.overwait, error))
+
+
+def evaluate_parallel(fd, seed=None, trace=None, block_size=READ_BLOCK_SIZE):
+    """ Evaluates the categories in separate processes and returns the
+    bill and whether a job waited too long.
+
+    The categories do not share jobs nor machines, only the start of the
+    trial period and the time of the evaluation, which are both taken from
+    the whole input here. The lines are sent to the workers by their
+    category field; the lines of any other shape are parsed to find it. """
+    import multiprocessing
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    queues = {}
+    workers = []
+    first = last = None
+    for lines in read_lines(fd, block_size):
+        if stop.is_set():
             break
-
-        m = job_re.match(line)
-        if m:
-            yield Job(m.groupdict())
+        routed = dict((category, []) for category in State.CATEGORIES)
+        for line in lines:
+            fields = line.split(' ')
+            category = fields[3] if 4 <= len(fields) <= 5 else None
+            if first is None or category not in routed:
+                event = parse_line(line)
+                if event is None:
+                    continue
+                category = event.category
+                if first is None:
+                    first = event
+            routed[category].append(line)
+        if first is None:
             continue
-        m = cmd_re.match(line)
-        if m:
-            yield Command(m.groupdict())
+        if not workers:
+            for category in State.CATEGORIES:
+                queues[category] = multiprocessing.Queue(16)
+                worker = multiprocessing.Process(target=category_worker, args=(
+                    category, queues[category], results, stop, seed, first.timestamp + State.TRIAL_ENDS, trace))
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+        for line in reversed(lines):
+            event = parse_line(line)
+            if event is not None:
+                last = event
+                break
+        for category, category_lines in routed.items():
+            if category_lines:
+                queues[category].put('\n'.join(category_lines))
+    if not workers:
+        return 0, False
+    for queue in queues.values():
+        queue.put(('end', last.timestamp))
+    bill, overwait = 0, False
+    for _ in workers:
+        category, category_bill, category_overwait, error = results.get()
+        if error:
+            raise RuntimeError('evaluating %s failed:\n%s' % (category, error))
+        bill += category_bill
+        overwait = overwait or category_overwait
+    for worker in workers:
+        worker.join()
+    return (-1 if overwait else bill), overwait
+
+
+# The stages of a pipeline hand the events on in lists of this many.
+PIPELINE_BATCH = 4096
+# A queue between two stages holds at most this many lists.
+PIPELINE_DEPTH = 8
+
+
+def batched(items, size):
+    """ Yields the items in lists of size, the last one shorter. """
+    items = iter(items)
+    return iter(lambda: list(itertools.islice(items, size)), [])
+
+
+class PipelineStage(object):
+    """ A stage of a Pipeline. work turns the iterable of the lists it
+    takes from the queue before the stage into the lists put on the queue
+    after it. The stage counts the lists and their items, and the seconds
+    it waited for the queue before it (starved) and after it (blocked). """
+
+    def __init__(self, name, work):
+        self.name = name
+        self.work = work
+        self.batches = 0
+        self.items = 0
+        self.started = None
+        self.finished = None
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def inputs(self, queue):
+        while True:
+            start = time.time()
+            batch = queue.get()
+            self.starved += time.time() - start
+            if batch is None:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+
+    def run(self, source, queue):
+        """ Runs the work on the lists of the source queue, None for the
+        first stage, and puts its lists on queue, None for the last stage,
+        followed by None. An error is put on the queue instead of the None. """
+        self.started = time.time()
+        try:
+            for batch in self.work(None if source is None else self.inputs(source)):
+                self.batches += 1
+                self.items += len(batch)
+                if queue is not None:
+                    start = time.time()
+                    queue.put(batch)
+                    self.blocked += time.time() - start
+        except Exception as e:
+            if queue is None:
+                raise
+            queue.put(e)
+        else:
+            if queue is not None:
+                queue.put(None)
+        finally:
+            self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - (self.started or time.time())
+
+    @property
+    def busy(self):
+        return self.elapsed - self.starved - self.blocked
+
+
+class Pipeline(object):
+    """ Runs stages on threads of their own, joined by queues of at most
+    depth lists each, so that a stage waits when the next one falls behind.
+    The threads share the interpreter lock, so the stages overlap only
+    where they do not hold it, reading and decompressing the input, but
+    the times of the stages show which one limits the others. """
+
+    def __init__(self, depth=PIPELINE_DEPTH):
+        self.depth = depth
+        self.stages = []
+
+    def add(self, name, work):
+        self.stages.append(PipelineStage(name, work))
+
+    def run(self):
+        """ Runs the stages, the last one on the calling thread, and returns
+        when it is done. A stage stopping early leaves the ones before it
+        waiting on their daemon threads. """
+        import Queue
+        import threading
+        source = None
+        for stage in self.stages[:-1]:
+            queue = Queue.Queue(self.depth)
+            thread = threading.Thread(target=stage.run, args=(source, queue))
+            thread.daemon = True
+            thread.start()
+            source = queue
+        self.stages[-1].run(source, None)
+
+    def report(self, fd=sys.stderr):
+        fd.write('%-10s %10s %12s %10s %10s %10s %10s %12s\n' % (
+            'stage', 'batches', 'items', 'seconds', 'busy', 'starved', 'blocked', 'items/busy s'))
+        for stage in self.stages:
+            fd.write('%-10s %10d %12d %10.3f %10.3f %10.3f %10.3f %12.0f\n' % (
+                stage.name, stage.batches, stage.items, stage.elapsed, stage.busy, stage.starved,
+                stage.blocked, stage.items / stage.busy if stage.busy > 0 else 0))
+        limiting = max(self.stages, key=lambda stage: stage.busy)
+        fd.write('limited by %s\n' % limiting.name)
+
+
+def receive_batches(state, batches):
+    """ The last stage of an evaluation pipeline: hands the events to the
+    state, up to the first one a job waits too long after. """
+    for batch in batches:
+        for count, event in enumerate(batch, 1):
+            state.receive(event)
+            if state.overwait:
+                yield batch[:count]
+                return
+        yield batch
+
+
+def evaluate_pipeline(state, path=None, strategy=None, depth=PIPELINE_DEPTH, block_size=READ_BLOCK_SIZE):
+    """ Hands the events of the log at path, or of the standard input, to
+    the state on a pipeline whose stages read the lines, parse them, run
+    the strategy, if there is one, and receive the events. Returns the
+    pipeline for the times of its stages. """
+    pipeline = Pipeline(depth)
+    if path is not None and is_compiled(path):
+        pipeline.add('read', lambda _: batched(read_compiled_events(path), PIPELINE_BATCH))
+    else:
+        fd = open_input(path) if path is not None else sys.stdin
+        pipeline.add('read', lambda _: read_lines(fd, block_size))
+        pipeline.add('parse', lambda blocks: batched(parse_lines(blocks), PIPELINE_BATCH))
+    if strategy is not None:
+        pipeline.add('strategy', lambda batches: batched(
+            run_strategy(strategy, itertools.chain.from_iterable(batches)), PIPELINE_BATCH))
+    pipeline.add('receive', lambda batches: receive_batches(state, batches))
+    pipeline.run()
+    return pipeline
 
 
 def parse_arguments():
+    import argparse
     parser = argparse.ArgumentParser(description='Prezi scale contest evaluator')
     parser.add_argument('-d', '--debug', dest='debug', action='store_true', default=False, help='turn on debugging')
+    parser.add_argument('-t', '--trace', dest='trace', default=None, help='write the trace events as JSON lines to this file')
+    parser.add_argument('-s', '--seed', dest='seed', type=int, default=None, help='seed of the random machine choice')
+    parser.add_argument('-c', '--compile', dest='compile', default=None,
+                        help='write the events to this compiled event file instead of evaluating them')
+    parser.add_argument('-p', '--parallel', dest='parallel', action='store_true', default=False,
+                        help='evaluate the categories in separate processes')
+    parser.add_argument('-S', '--strategy', dest='strategy', default=None,
+                        help='run the competitor strategy module:Class in this process on the log')
+    parser.add_argument('-w', '--sweep', dest='sweep', action='append', default=[], metavar='NAME=VALUE,...',
+                        help='evaluate the strategy with every combination of these parameter values')
+    parser.add_argument('-j', '--processes', dest='processes', type=int, default=None,
+                        help='number of processes of the sweep, one per CPU by default')
+    parser.add_argument('-k', '--checkpoint', dest='checkpoint', default=None,
+                        help='write snapshots of the run to this file, formatted with {events} and {time}')
+    parser.add_argument('--checkpoint-events', dest='checkpoint_events', type=int, default=1000000,
+                        help='write a snapshot after this many events')
+    parser.add_argument('--checkpoint-seconds', dest='checkpoint_seconds', type=int, default=None,
+                        help='write a snapshot after this many seconds of simulated time')
+    parser.add_argument('-r', '--resume', dest='resume', default=None,
+                        help='resume the run of this snapshot, on its input unless one is given')
+    parser.add_argument('--stats', dest='stats', action='store_true', default=False,
+                        help='count and time the work of the evaluation, and write a summary to stderr')
+    parser.add_argument('--progress', dest='progress', type=int, default=None, metavar='EVENTS',
+                        help='write a progress line to stderr every EVENTS events, with --stats')
+    parser.add_argument('--batch-billing', dest='batch_billing', action='store_true', default=False,
+                        help='record the machines terminated and bill them in one pass at the end')
+    parser.add_argument('--report', dest='report', default=None,
+                        help='write the costs and the use of the machines per hour and category to this file')
+    parser.add_argument('--report-format', dest='report_format', choices=['csv', 'json'], default='csv',
+                        help='format of the report: CSV or JSON lines')
+    parser.add_argument('-E', '--event-core', dest='event_core', action='store_true', default=False,
+                        help='simulate with the discrete event core, EventState')
+    parser.add_argument('-P', '--pipeline', dest='pipeline', action='store_true', default=False,
+                        help='read, parse, run the strategy and simulate on threads joined by queues, '
+                             'and write the times of the stages to stderr')
+    parser.add_argument('--pipeline-depth', dest='pipeline_depth', type=int, default=PIPELINE_DEPTH,
+                        help='lists of %d events a queue of the pipeline holds at most' % PIPELINE_BATCH)
     return parser.parse_known_args()
 
 
 def set_logger():
-    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+    engine.set_logger(sys.stderr)
 
 
 def main():
     args, rest = parse_arguments()
     if args.debug:
         set_logger()
-    state = State()
-    with open(rest[0]) if rest else sys.stdin as fd:
-        for event in read_events(fd):
+    if args.sweep:
+        if not args.strategy or args.compile or args.parallel:
+            sys.exit('the sweep needs a strategy, and neither compiles nor runs in parallel mode')
+        for parameters, bill, overwait in evaluate_sweep(rest[0] if rest else None, args.strategy,
+                                                         parse_sweep(args.sweep), args.seed, args.processes):
+            fields = ['%s=%s' % item for item in sorted(parameters.items())] + [str(bill)]
+            print ' '.join(fields + (['overwait'] if overwait else []))
+        return
+    if args.checkpoint or args.resume:
+        if args.compile or args.parallel or args.pipeline:
+            sys.exit('runs with snapshots neither compile nor run in parallel or pipeline mode')
+        if args.stats or args.report:
+            # Both wrap methods of the state, which the snapshots cannot pickle.
+            sys.exit('runs with snapshots take neither --stats nor --report')
+        trace_fd = open(args.trace, 'w') if args.trace else None
+        if args.resume:
+            snapshot = load_snapshot(args.resume)
+            state = snapshot['state']
+            state.set_sink(TraceSink(trace_fd) if trace_fd else None)
+            # A new strategy takes over the tail of the run.
+            strategy = load_strategy(args.strategy) if args.strategy else snapshot['strategy']
+            reader = InputReader(rest[0] if rest else snapshot['input'], snapshot['position'])
+            started, events = True, snapshot['events']
+        else:
+            state = (EventState if args.event_core else State)(
+                TraceSink(trace_fd) if trace_fd else None, args.seed, batch_billing=args.batch_billing)
+            strategy = load_strategy(args.strategy) if args.strategy else None
+            reader = InputReader(rest[0] if rest else None)
+            started, events = False, 0
+        run_checkpointed(state, reader, strategy, started, events, args.checkpoint,
+                         args.checkpoint_events, args.checkpoint_seconds)
+        print state.evaluate()
+        if trace_fd:
+            trace_fd.close()
+        sys.exit(1 if state.overwait else 0)
+    if args.stats and (args.compile or args.parallel or args.pipeline):
+        sys.exit('--stats works in the serial mode only')
+    if args.pipeline and (args.compile or args.parallel):
+        sys.exit('the pipeline neither compiles nor runs in parallel mode')
+    if args.report and (args.compile or args.parallel or args.batch_billing):
+        sys.exit('--report works in the serial mode only, billing one machine at a time')
+    stats = Stats(progress=args.progress) if args.stats else None
+    events = read_file_events(rest[0]) if rest else read_events(sys.stdin)
+    if stats:
+        events = stats.read_events(events)
+    strategy = load_strategy(args.strategy) if args.strategy else None
+    if strategy:
+        events = run_strategy(strategy, events)
+    if args.compile:
+        compile_events(events, args.compile)
+        return
+    if args.parallel:
+        if args.strategy:
+            sys.exit('the parallel mode does not run strategies')
+        if rest and is_compiled(rest[0]):
+            sys.exit('the parallel mode reads text logs only')
+        with open_input(rest[0]) if rest else sys.stdin as fd:
+            bill, overwait = evaluate_parallel(fd, args.seed, args.trace)
+        print bill
+        sys.exit(1 if overwait else 0)
+    trace_fd = open(args.trace, 'w') if args.trace else None
+    state = (EventState if args.event_core else State)(
+        TraceSink(trace_fd) if trace_fd else None, args.seed, batch_billing=args.batch_billing)
+    if stats:
+        instrument(state, stats)
+    report_fd = open(args.report, 'w') if args.report else None
+    if report_fd:
+        attach_report(state, Report(report_fd, args.report_format))
+    pipeline = None
+    if args.pipeline:
+        pipeline = evaluate_pipeline(state, rest[0] if rest else None, strategy, args.pipeline_depth)
+    else:
+        for event in events:
             state.receive(event)
             if state.overwait:
                 break
     print state.evaluate()
+    if trace_fd:
+        trace_fd.close()
+    if report_fd:
+        report_fd.close()
+    if stats:
+        stats.report()
+    if pipeline:
+        pipeline.report()
     sys.exit(1 if state.overwait else 0)
 
 if __name__ == '__main__':
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import argparse
+import math
+import random
+import sys
+import time
+
+# The line formats of the evaluators and their category names.
+FORMATS = {
+    'spring': ['general', 'url', 'export'],
+    'fall': ['default', 'url', 'export'],
+}
+DURATIONS = ['exponential', 'lognormal', 'fixed']
+# Lines are written in chunks of this many.
+WRITE_CHUNK = 10000
+
+
+class LogGenerator(object):
+    """ Generates a log of jobs arriving at a steady rate, with the machines
+    the evaluators need to run them.
+
+    Jobs arrive rate times a second on average, with exponentially
+    distributed gaps, and go to the categories in the proportions of mix.
+    Every category starts with machines machines, launched at the start,
+    and churn times an hour on average a category launches or terminates
+    one, keeping at least half of its fleet. """
+
+    def __init__(self, fmt='spring', rate=5.0, duration='exponential', mean_duration=10.0,
+                 mix=None, machines=60, churn=2.0, start=1370000000, seed=None):
+        self.fmt = fmt
+        self.rate = rate
+        self.duration = duration
+        self.mean_duration = mean_duration
+        self.mix = mix or dict((category, 1.0) for category in FORMATS[fmt])
+        unknown = set(self.mix) - set(FORMATS[fmt])
+        if unknown:
+            raise ValueError('unknown categories for the %s format: %s' % (fmt, ', '.join(sorted(unknown))))
+        self.machines = machines
+        self.churn = churn
+        self.start = start
+        self.random = random.Random(seed)
+
+    def timestamp(self, now):
+        if self.fmt == 'spring':
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now))
+        return str(now)
+
+    def job_line(self, stamp, category, length, guid):
+        if self.fmt == 'spring':
+            return '%s %s %s %.3f\n' % (stamp, guid, category, length)
+        return '%s %.3f %s %s\n' % (stamp, length, guid, category)
+
+    def job_length(self):
+        if self.duration == 'exponential':
+            return self.random.expovariate(1.0 / self.mean_duration)
+        if self.duration == 'lognormal':
+            # The mean of a lognormal distribution is exp(mu + sigma^2 / 2).
+            return self.random.lognormvariate(math.log(self.mean_duration) - 0.5, 1.0)
+        return self.mean_duration
+
+    def guid(self):
+        digits = '%032x' % self.random.getrandbits(128)
+        return '-'.join((digits[:8], digits[8:12], digits[12:16], digits[16:20], digits[20:]))
+
+    def lines(self, count):
+        """ Yields count lines of the log. """
+        rnd = self.random
+        categories = sorted(self.mix)
+        total = float(sum(self.mix.values()))
+        bounds = []
+        weight = 0.0
+        for category in categories:
+            weight += self.mix[category]
+            bounds.append(weight / total)
+        fleet = dict((category, self.machines) for category in categories)
+        churn_rate = self.churn * len(categories) / 3600.0
+        now = float(self.start)
+        stamp_time, stamp = None, None
+        emitted = 0
+        for category in categories:
+            for _ in xrange(min(self.machines, count - emitted)):
+                yield '%s launch %s\n' % (self.timestamp(self.start), category)
+                emitted += 1
+        next_churn = now + rnd.expovariate(churn_rate) if churn_rate else float('inf')
+        while emitted < count:
+            now += rnd.expovariate(self.rate)
+            if int(now) != stamp_time:
+                stamp_time = int(now)
+                stamp = self.timestamp(stamp_time)
+            if now >= next_churn:
+                next_churn = now + rnd.expovariate(churn_rate)
+                category = rnd.choice(categories)
+                if rnd.random() < 0.5 or fleet[category] <= self.machines // 2:
+                    fleet[category] += 1
+                    yield '%s launch %s\n' % (stamp, category)
+                else:
+                    fleet[category] -= 1
+                    yield '%s terminate %s\n' % (stamp, category)
+            else:
+                pick = rnd.random()
+                i = 0
+                while bounds[i] < pick:
+                    i += 1
+                yield self.job_line(stamp, categories[i], self.job_length(), self.guid())
+            emitted += 1
+
+
+def parse_mix(text):
+    """ Parses category=weight,category=weight,... """
+    mix = {}
+    for item in text.split(','):
+        category, _, weight = item.partition('=')
+        mix[category] = float(weight)
+    return mix
+
+
+def write_log(generator, count, fd):
+    lines = generator.lines(count)
+    while True:
+        chunk = [line for _, line in zip(xrange(WRITE_CHUNK), lines)]
+        if not chunk:
+            break
+        fd.write(''.join(chunk))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Synthetic log generator for the Prezi scale contest evaluators')
+    parser.add_argument('-n', '--events', dest='events', type=int, default=100000, help='number of lines to write')
+    parser.add_argument('-f', '--format', dest='format', choices=sorted(FORMATS), default='spring',
+                        help='line format: spring for evaluator.py, fall for 2013-fall-evaluator.py')
+    parser.add_argument('-r', '--rate', dest='rate', type=float, default=5.0, help='jobs a second on average')
+    parser.add_argument('--duration', dest='duration', choices=DURATIONS, default='exponential',
+                        help='distribution of the job durations')
+    parser.add_argument('--mean-duration', dest='mean_duration', type=float, default=10.0,
+                        help='mean job duration in seconds')
+    parser.add_argument('--mix', dest='mix', default=None,
+                        help='category weights as category=weight,...; equal weights by default')
+    parser.add_argument('-m', '--machines', dest='machines', type=int, default=60,
+                        help='machines launched at the start in every category')
+    parser.add_argument('--churn', dest='churn', type=float, default=2.0,
+                        help='launches and terminations an hour in every category')
+    parser.add_argument('--start', dest='start', type=int, default=1370000000, help='unix time of the first line')
+    parser.add_argument('-s', '--seed', dest='seed', type=int, default=None, help='random seed')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    generator = LogGenerator(args.format, args.rate, args.duration, args.mean_duration,
+                             parse_mix(args.mix) if args.mix else None, args.machines, args.churn,
+                             args.start, args.seed)
+    write_log(generator, args.events, sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import argparse
+import heapq
+import math
+import sys
+
+import engine
+
+
+class CapacitySweep(object):
+    """ Sweeps over the intervals in which the jobs of a category are
+    running whichever machine takes them. A job arriving at t has to start
+    by t + queue_time, so it runs from then to t + its length at the latest
+    start, and every job running at a time needs a machine of its own.
+
+    Every machine is billed for the hours it runs, so its bill is at least
+    one, at least its busy time in hours and, as the hours it is billed for
+    span at most one more hour of the clock, at least half the hours of the
+    clock it is running in. The bound is the largest of the bills these
+    give the machines the jobs need: the peak of the running jobs, their
+    lengths in hours and half the sum of the peaks of every hour. """
+
+    def __init__(self, queue_time, billing_unit):
+        self.queue_time = queue_time
+        self.unit = billing_unit
+        # The ends of the intervals running at the time of the sweep.
+        self.ends = []
+        self.hour = None
+        self.hour_peak = 0
+        # The sum of the peaks of the hours closed so far.
+        self.hour_peaks = 0
+        self.peak = 0
+        self.busy = 0.0
+        self.jobs = 0
+
+    def advance(self, time):
+        """ Moves the sweep to time and returns the (hour, peak) pairs of
+        the hours it closed with jobs running. """
+        closed = []
+        hour = int(time // self.unit)
+        if self.hour is None:
+            self.hour = hour
+        while self.hour < hour:
+            self.pop((self.hour + 1) * self.unit)
+            if self.hour_peak:
+                closed.append((self.hour, self.hour_peak))
+                self.hour_peaks += self.hour_peak
+            # The jobs running at its start are the least of the next hour.
+            self.hour_peak = len(self.ends)
+            self.hour = self.hour + 1 if self.ends else hour
+        self.pop(time)
+        return closed
+
+    def pop(self, time):
+        ends = self.ends
+        while ends and ends[0] <= time:
+            heapq.heappop(ends)
+
+    def job(self, timestamp, duration):
+        """ Adds a job and returns the hours closed before it starts. """
+        start = timestamp + self.queue_time
+        end = timestamp + duration
+        closed = self.advance(start)
+        self.jobs += 1
+        self.busy += duration
+        if end > start:
+            heapq.heappush(self.ends, end)
+            self.hour_peak = max(self.hour_peak, len(self.ends))
+            self.peak = max(self.peak, len(self.ends))
+        return closed
+
+    def finish(self):
+        """ Runs the sweep to the end of the last job and returns the hours
+        it closed, the last one included. """
+        closed = self.advance(max(self.ends)) if self.ends else []
+        if self.hour_peak:
+            closed.append((self.hour, self.hour_peak))
+            self.hour_peaks += self.hour_peak
+            self.hour_peak = 0
+        return closed
+
+    def bill(self):
+        """ The lower bound of the bill of the jobs so far. """
+        return max(self.peak, int(math.ceil(self.busy / self.unit)),
+                   int(math.ceil((self.hour_peaks + self.hour_peak) / 2.0)))
+
+
+class LowerBound(object):
+    """ The lower bound of the bill of any competitor on a log, updated
+    with every event, by category. The jobs of the trial period may wait
+    any time, and are not bounded. The fall rules are swept twice: for
+    the jobs to start by MAX_QUEUE_TIME, which the bound is taken from,
+    and by FREE_QUEUE_TIME, the capacity a competitor paying no penalty
+    needs. """
+
+    def __init__(self, rules, hours_fd=None):
+        self.rules = rules
+        self.hours_fd = hours_fd
+        self.trial = None
+        unit = engine.Machine.BILLING_UNIT
+        free_time = getattr(rules, 'FREE_QUEUE_TIME', None)
+        self.sweeps = {}
+        self.free_sweeps = {}
+        # The peaks of the hours closed by the sweeps, waiting for the
+        # penalty free sweep to close the same hours.
+        self.pending = dict((category, {}) for category in rules.CATEGORIES)
+        for category in rules.CATEGORIES:
+            self.sweeps[category] = CapacitySweep(rules.MAX_QUEUE_TIME, unit)
+            if free_time is not None:
+                self.free_sweeps[category] = CapacitySweep(free_time, unit)
+        if hours_fd:
+            hours_fd.write('hour,category,capacity%s\n' % (',free_capacity' if self.free_sweeps else ''))
+
+    def receive(self, event):
+        if self.trial is None:
+            self.trial = event.timestamp + self.rules.TRIAL_ENDS
+        if not isinstance(event, engine.Job) or event.timestamp <= self.trial:
+            return
+        closed = self.sweeps[event.category].job(event.timestamp, event.duration)
+        free_closed = []
+        if self.free_sweeps:
+            free_closed = self.free_sweeps[event.category].job(event.timestamp, event.duration)
+        self.write_hours(event.category, closed, free_closed)
+
+    def finish(self):
+        for category in self.rules.CATEGORIES:
+            closed = self.sweeps[category].finish()
+            free_closed = self.free_sweeps[category].finish() if self.free_sweeps else []
+            self.write_hours(category, closed, free_closed)
+
+    def write_hours(self, category, closed, free_closed):
+        """ Writes the peaks of the closed hours. The penalty free sweep
+        starts the jobs earlier, so it closes an hour after the other one,
+        and its peak is never the lower one. """
+        if not self.hours_fd:
+            return
+        unit = engine.Machine.BILLING_UNIT
+        if not self.free_sweeps:
+            for hour, peak in closed:
+                self.hours_fd.write('%d,%s,%d\n' % (hour * unit, category, peak))
+            return
+        peaks = self.pending[category]
+        peaks.update(closed)
+        for hour, free_peak in free_closed:
+            self.hours_fd.write('%d,%s,%d,%d\n' % (hour * unit, category, peaks.pop(hour, 0), free_peak))
+
+    def bill(self):
+        return sum(sweep.bill() for sweep in self.sweeps.values())
+
+    def write(self, fd=sys.stdout):
+        columns = ['category', 'jobs', 'busy hours', 'peak', 'bound']
+        if self.free_sweeps:
+            columns += ['free peak', 'free bound']
+        fd.write(' '.join('%12s' % column for column in columns) + '\n')
+        for category in sorted(self.sweeps):
+            sweep = self.sweeps[category]
+            row = ['%12s' % category, '%12d' % sweep.jobs, '%12.1f' % (sweep.busy / sweep.unit),
+                   '%12d' % sweep.peak, '%12d' % sweep.bill()]
+            if self.free_sweeps:
+                free = self.free_sweeps[category]
+                row += ['%12d' % free.peak, '%12d' % free.bill()]
+            fd.write(' '.join(row) + '\n')
+        fd.write('lower bound %d\n' % self.bill())
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Lower bound of the bill of a job log for the Prezi scale contest')
+    parser.add_argument('-e', '--evaluator', dest='evaluator', choices=sorted(engine.RULES), default='spring',
+                        help='the rule set and log format to use')
+    parser.add_argument('--hours', dest='hours', default=None,
+                        help='write the least capacity needed every hour and category to this file, as CSV')
+    parser.add_argument('--progress', dest='progress', type=int, default=None, metavar='EVENTS',
+                        help='write the bound so far to stderr every EVENTS events')
+    parser.add_argument('log', nargs='?', default=None, help='the log, the standard input by default')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    rules, fmt = engine.RULES[args.evaluator]
+    hours_fd = open(args.hours, 'w') if args.hours else None
+    bound = LowerBound(rules, hours_fd)
+    events = engine.read_file_events(args.log, fmt) if args.log else engine.read_events(sys.stdin, fmt)
+    for count, event in enumerate(events, 1):
+        bound.receive(event)
+        if args.progress and count % args.progress == 0:
+            sys.stderr.write('%d events, at %d, lower bound %d\n' % (count, event.timestamp, bound.bill()))
+    bound.finish()
+    if hours_fd:
+        hours_fd.close()
+    bound.write()
+
+if __name__ == '__main__':
+    main()
@@ -21,28 +21,28 @@
 #
 import sys
 
+import evaluator
 
-def procLine(line):
-    if line:
-        return dict(zip(('date', 'time', 'id', 'queue', 'length'), line.split()))
 
+class SimpleCompetitor(evaluator.Strategy):
+    """ Keeps the given number of machines of every kind running from the
+    first event to the last. """
 
-def servers(date_time, command):
-    if date_time:
-        for i in range(100):
-            for kind in ['general', 'url', 'export']:
-                sys.stdout.write(' '.join((date_time['date'], date_time['time'], command, kind, '\n')))
+    def __init__(self, machines=100):
+        self.machines = machines
+
+    def servers(self, command):
+        return [(command, kind) for i in range(self.machines) for kind in ['general', 'url', 'export']]
+
+    def start(self, event):
+        return self.servers('launch')
+
+    def finish(self, event):
+        return self.servers('terminate')
 
 
 def main():
-    line = sys.stdin.readline()
-    first_event = last_event = procLine(line)
-    servers(first_event, 'launch')
-    while line:
-        last_event = procLine(line)
-        sys.stdout.write(line)
-        line = sys.stdin.readline()
-    servers(last_event, 'terminate')
+    evaluator.pipe_strategy(SimpleCompetitor(), sys.stdin, sys.stdout)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,192 @@
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import engine
+import evaluator
+import generate_log
+import simple_competitor
+from test_regression import LOGS, SEED, run
+
+# Logs the competitor copies: a first event beyond the first blocks read,
+# a last line without a newline, CRLF lines, lines which are no events
+# before and after the events, a single event on the last line and no
+# event at all.
+JOBS = [
+    '2013-06-01 00:00:00 3f2a-11 general 12.345\n',
+    '2013-06-01 00:00:01 3f2a-12 url 0.5\n',
+    '2013-06-01 00:59:59 launch export\n',
+    '2013-06-01 01:00:00 3f2a-13 export 1.25\n',
+]
+TEXTS = [
+    ''.join(JOBS),
+    ''.join(JOBS)[:-1],
+    ''.join(line.replace('\n', '\r\n') for line in JOBS),
+    '# a header\n\n' * 20 + ''.join(JOBS),
+    ''.join(JOBS) + 'garbage\n\n',
+    ''.join(JOBS) + 'garbage',
+    '\n'.join(['first'] + JOBS[:1]),
+    'first\n' + JOBS[0][:-1],
+    'no event\n',
+    '',
+]
+BLOCK_SIZES = [1, 2, 7, 40, 1 << 20]
+
+
+def baseline_competitor(text):
+    """ What simple_competitor.py wrote before it copied its input by
+    blocks, for a log starting with an event and ending in a newline. """
+    def proc_line(line):
+        if line:
+            return dict(zip(('date', 'time', 'id', 'queue', 'length'), line.split()))
+
+    def servers(date_time, command):
+        if date_time:
+            for i in range(100):
+                for kind in ['general', 'url', 'export']:
+                    out.append(' '.join((date_time['date'], date_time['time'], command, kind, '\n')))
+
+    out = []
+    lines = StringIO(text).readlines()
+    servers(proc_line(lines[0]), 'launch')
+    out.extend(lines)
+    servers(proc_line(lines[-1]), 'terminate')
+    return ''.join(out)
+
+
+def key(event):
+    if isinstance(event, engine.Job):
+        return ('job', event.timestamp, event.category, event.duration, event.guid)
+    return ('command', event.timestamp, event.category, event.cmd)
+
+
+def events(text):
+    return [key(event) for event in engine.read_events(StringIO(text), engine.SpringFormat)]
+
+
+def without_commands(text):
+    """ The lines of text which are no commands. """
+    return ''.join(line for line in StringIO(text) if not isinstance(engine.SpringFormat.parse_line(line),
+                                                                       engine.Command))
+
+
+class OnJob(evaluator.Strategy):
+    """ Launches a machine for every url job and terminates one for every
+    export job. """
+
+    def start(self, event):
+        return [('launch', 'general')]
+
+    def on_job(self, job):
+        if job.category == 'url':
+            return [('launch', 'url')]
+        if job.category == 'export':
+            return [('terminate', 'export'), ('launch', 'general')]
+        return []
+
+    def finish(self, event):
+        return [('terminate', 'general')]
+
+
+class CompetitorTest(unittest.TestCase):
+    """ pipe_strategy writes the input with the commands of the strategy
+    among its lines, whatever the size of the blocks it reads. """
+
+    # Shows the logs which differ along with the block size.
+    longMessage = True
+
+    def pipe(self, strategy, text, block_size):
+        fd = StringIO()
+        evaluator.pipe_strategy(strategy, StringIO(text), fd, block_size)
+        return fd.getvalue()
+
+    def test_copy(self):
+        strategy = simple_competitor.SimpleCompetitor(2)
+        for text in TEXTS:
+            expected = events(text)
+            if expected:
+                first, last = expected[0][1], expected[-1][1]
+                expected = ([('command', first, category, 'launch') for _, category in strategy.start(None)] +
+                            expected +
+                            [('command', last, category, 'terminate') for _, category in strategy.finish(None)])
+            # A last line without a newline gets one before the commands.
+            copied = text + '\n' if expected and not text.endswith('\n') else text
+            for block_size in BLOCK_SIZES:
+                out = self.pipe(strategy, text, block_size)
+                message = '%r, block size %d' % (text, block_size)
+                self.assertEqual(events(out), expected, message)
+                self.assertEqual(without_commands(out), without_commands(copied), message)
+
+    def test_baseline(self):
+        # The logs the baseline competitor read right: an event on the first
+        # line and a newline at the end.
+        with open(self.log) as fd:
+            log = fd.read()
+        for text in [TEXTS[0], TEXTS[2], log]:
+            expected = events(baseline_competitor(text))
+            for block_size in BLOCK_SIZES:
+                self.assertEqual(events(self.pipe(simple_competitor.SimpleCompetitor(), text, block_size)), expected,
+                                 '%r, block size %d' % (text[:80], block_size))
+
+    def test_on_job(self):
+        for text in TEXTS:
+            expected = [key(event) for event in evaluator.run_strategy(OnJob(), engine.read_events(
+                StringIO(text), engine.SpringFormat))]
+            for block_size in BLOCK_SIZES:
+                self.assertEqual(events(self.pipe(OnJob(), text, block_size)), expected,
+                                 '%r, block size %d' % (text, block_size))
+
+    def test_evaluator(self):
+        # The competitor piped into the evaluator and the strategy run in it
+        # give the same bill.
+        with open(self.log) as fd:
+            process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'simple_competitor.py')], stdin=fd,
+                                       stdout=subprocess.PIPE)
+            status, piped, err = run('evaluator.py', SEED, process.stdout)
+            process.wait()
+        self.assertEqual((process.returncode, status), (0, 0), err)
+        status, out, err = run('evaluator.py', SEED + ['--strategy', 'simple_competitor:SimpleCompetitor', self.log])
+        self.assertEqual((status, out), (0, piped), err)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.log = os.path.join(cls.directory, 'spring.log')
+        arguments, lines = LOGS['spring']
+        with open(cls.log, 'w') as fd:
+            generate_log.write_log(generate_log.LogGenerator(**arguments), lines, fd)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import engine
+import generate_log
+import lower_bound
+from test_regression import LOGS, SEED
+
+HOUR = engine.Machine.BILLING_UNIT
+
+
+def job(timestamp, duration, category='default'):
+    return engine.Job(timestamp, category, duration, 'guid-%d' % timestamp)
+
+
+class CapacitySweepTest(unittest.TestCase):
+    """ The bounds of small sets of jobs, worked out by hand, with the
+    queue time of the spring rules. """
+
+    def sweep(self, jobs):
+        sweep = lower_bound.CapacitySweep(5, HOUR)
+        closed = []
+        for timestamp, duration in jobs:
+            closed += sweep.job(timestamp, duration)
+        return sweep, closed + sweep.finish()
+
+    def test_overlapping(self):
+        # [5, 100), [15, 110) and [25, 70) all run at 25.
+        sweep, closed = self.sweep([(0, 100), (10, 100), (20, 50)])
+        self.assertEqual((sweep.peak, sweep.busy, sweep.jobs), (3, 250.0, 3))
+        self.assertEqual(closed, [(0, 3)])
+        self.assertEqual(sweep.bill(), 3)
+
+    def test_shorter_than_queue_time(self):
+        # Either job may wait until the other one is done.
+        sweep, closed = self.sweep([(0, 4), (1, 5)])
+        self.assertEqual((sweep.peak, closed), (0, []))
+        # The machine running them is still billed an hour.
+        self.assertEqual(sweep.bill(), 1)
+
+    def test_busy_hours(self):
+        # [3505, 10800) ends on the edge of the hour 3, which it does not
+        # run in. Its 7300 seconds take 3 hours.
+        sweep, closed = self.sweep([(3500, 7300)])
+        self.assertEqual(closed, [(0, 1), (1, 1), (2, 1)])
+        self.assertEqual(sweep.peak, 1)
+        self.assertEqual(sweep.bill(), 3)
+
+    def test_hour_boundaries(self):
+        # Short jobs across the start of the hours 1 to 4: one machine runs
+        # in every hour from 0 to 4, so the hourly peaks add up to 5, and
+        # the machines are billed at least 3 hours.
+        sweep, closed = self.sweep([(hour * HOUR - 10, 20) for hour in range(1, 5)])
+        self.assertEqual(closed, [(hour, 1) for hour in range(5)])
+        self.assertEqual((sweep.peak, int(sweep.busy)), (1, 80))
+        self.assertEqual(sweep.bill(), 3)
+
+    def test_idle_hours(self):
+        # The hours without jobs between two jobs are not closed.
+        sweep, closed = self.sweep([(0, 100), (5 * HOUR, 100)])
+        self.assertEqual(closed, [(0, 1), (5, 1)])
+        self.assertEqual(sweep.bill(), 1)
+
+
+class LowerBoundTest(unittest.TestCase):
+    """ LowerBound by category, its trial period and its hours. """
+
+    def bound(self, rules, events):
+        hours = StringIO()
+        bound = lower_bound.LowerBound(rules, hours)
+        for event in events:
+            bound.receive(event)
+        bound.finish()
+        return bound, hours.getvalue().splitlines()
+
+    def test_trial(self):
+        # The trial starts with the first event, the jobs up to its end
+        # are not bounded.
+        start = 1370000000
+        trial = start + engine.SpringState.TRIAL_ENDS
+        bound, hours = self.bound(engine.SpringState, [
+            engine.Command(start, 'general', 'launch'),
+            job(start + 100, 2 * HOUR, 'general'),
+            job(trial, HOUR, 'general'),
+            job(trial + 1, 100, 'url'),
+            job(trial + 2, 100, 'url'),
+        ])
+        self.assertEqual([bound.sweeps[category].jobs for category in ['general', 'export', 'url']], [0, 0, 2])
+        self.assertEqual(bound.bill(), 2)
+        hour = (trial + 6) // HOUR * HOUR
+        self.assertEqual(hours, ['hour,category,capacity', '%d,url,2' % hour])
+
+    def test_fall_hours(self):
+        # The penalty free sweep starts the jobs 115 seconds earlier: the
+        # first job runs in the hour 0 only for it, and its row waits for
+        # it. [3620, 3800) and [7120, 8000) need a machine in the hours 1
+        # and 2, [3505, 3800) and [7005, 8000) in the hours 0 to 2.
+        bound, hours = self.bound(engine.FallState, [
+            engine.Command(0, 'default', 'launch'),
+            job(3500, 300),
+            job(7000, 1000),
+        ])
+        self.assertEqual(hours, ['hour,category,capacity,free_capacity',
+                                 '0,default,0,1', '3600,default,1,1', '7200,default,1,1'])
+        self.assertEqual(bound.bill(), 1)
+        self.assertEqual(bound.free_sweeps['default'].bill(), 2)
+
+    def test_fall_peaks(self):
+        # [1005, 1200) and [1095, 1290) overlap, [1120, 1200) and
+        # [1210, 1290) do not: the jobs run together when they start within
+        # FREE_QUEUE_TIME, not when they may wait MAX_QUEUE_TIME.
+        bound, hours = self.bound(engine.FallState, [
+            engine.Command(0, 'export', 'launch'),
+            job(1000, 200, 'export'),
+            job(1090, 200, 'export'),
+        ])
+        self.assertEqual((bound.sweeps['export'].peak, bound.free_sweeps['export'].peak), (1, 2))
+        self.assertEqual(hours[1:], ['0,export,1,2'])
+
+    def test_write(self):
+        bound, _ = self.bound(engine.SpringState, [])
+        fd = StringIO()
+        bound.write(fd)
+        self.assertEqual(fd.getvalue().splitlines()[-1], 'lower bound 0')
+
+
+class RegressionLogTest(unittest.TestCase):
+    """ No run of the evaluators bills less than the bound of its log. """
+
+    def check(self, name, state):
+        rules, fmt = engine.RULES[name]
+        arguments, lines = LOGS[name]
+        text = StringIO()
+        generate_log.write_log(generate_log.LogGenerator(**arguments), lines, text)
+        bound = lower_bound.LowerBound(rules)
+        for event in engine.read_events(StringIO(text.getvalue()), fmt):
+            bound.receive(event)
+            state.receive(event)
+        bound.finish()
+        self.assertTrue(0 < bound.bill() <= state.evaluate(), (bound.bill(), state.evaluate()))
+
+    def test_spring(self):
+        self.check('spring', engine.SpringState(seed=int(SEED[1])))
+
+    def test_fall(self):
+        self.check('fall', engine.FallState())
+
+
+if __name__ == '__main__':
+    unittest.main()
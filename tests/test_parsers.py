@@ -0,0 +1,141 @@
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import os
+import random
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import engine
+
+# Lines of both formats: events, events with CRLF, trailing spaces and
+# extra fields, and lines which are no events or only look like them.
+LINES = {
+    engine.SpringFormat: [
+        '2013-06-01 00:00:00 launch url',
+        '2013-06-01 00:00:01 3f2a-11 general 12.345',
+        '2013-06-01 00:00:01 3f2a-12 export 0.5\r',
+        '2013-06-01 00:00:02 terminate general\r',
+        '2013-06-01 00:00:02 3f2a-13 url 1.25 ',
+        '2013-06-01 00:00:03 launch export ',
+        '2013-06-01 00:00:03 3f2a-14 url 1.25 extra',
+        '2013-06-01 00:00:03 launch url extra fields',
+        '2013-06-01 23:59:59 3f2a-15 general 7.0',
+        '2013-06-02 00:00:00 3f2a-16 general 7',
+        '2013-06-02 00:00:00 3f2a-17 general .5',
+        '2013-06-02 00:00:00 3f2a-18 gen-eral 1.5',
+        '2013-06-02 00:00:00  general 1.5',
+        '2013-13-01 00:00:00 3f2a-19 general 1.5',
+        '9999-99-99 abc-def terminate 1.5',
+        '2013-06-02 0:00:00 launch url',
+        '2013-06-02 99:99:99 launch url',
+        '2013-06-02 00:00:00 launch',
+        'garbage',
+        '',
+        ' ',
+    ],
+    engine.FallFormat: [
+        '1370044800 launch url',
+        '1370044801 12.345 3f2a-11 default',
+        '1370044801 0.5 3f2a-12 export\r',
+        '1370044802 terminate default\r',
+        '1370044802 1.25 3f2a-13 url ',
+        '1370044803 launch export ',
+        '1370044803 1.25 3f2a-14 url extra',
+        '1370044803 launch url extra',
+        '1370044804 7 3f2a-15 default',
+        '1370044804 .5 3f2a-16 default',
+        '1370044804 1.5 3f2a-17 de-fault',
+        '1370044804 1.5  default',
+        '-1370044804 1.5 3f2a-18 default',
+        '13700448x4 launch url',
+        '2013-06-01 00:00:00 launch url',
+        '1370044805 launch',
+        'garbage',
+        '',
+        ' ',
+    ],
+}
+BLOCK_SIZES = [1, 2, 3, 7, 64, 1 << 20]
+
+
+def fields(event):
+    if isinstance(event, engine.Job):
+        return ('job', event.timestamp, event.category, event.duration, event.guid)
+    return ('command', event.timestamp, event.category, event.cmd)
+
+
+def parse(text, fmt, block_size=None):
+    """ The fields of the events of text, by the fast parser with the block
+    size, or by the regex parser. Returns the type of the error raised in
+    place of the events after it. """
+    if block_size is None:
+        events = engine.read_events_re(StringIO(text), fmt)
+    else:
+        events = engine.read_events(StringIO(text), fmt, block_size)
+    parsed = []
+    try:
+        for event in events:
+            parsed.append(fields(event))
+    except ValueError as e:
+        parsed.append(type(e))
+    return parsed
+
+
+class ReadEventsTest(unittest.TestCase):
+    """ read_events yields the events of read_events_re. """
+
+    def check(self, fmt, text):
+        expected = parse(text, fmt)
+        for block_size in BLOCK_SIZES:
+            self.assertEqual(parse(text, fmt, block_size), expected, 'block size %d: %r' % (block_size, text))
+
+    def test_lines(self):
+        for fmt, lines in LINES.items():
+            for line in lines:
+                for end in ['', '\n']:
+                    self.check(fmt, line + end)
+
+    def test_logs(self):
+        for fmt, lines in LINES.items():
+            # Both parsers stop at a day which does not exist.
+            lines = [line for line in lines if ValueError not in parse(line, fmt)]
+            events = [line for line in lines if parse(line, fmt)]
+            self.assertEqual(len(parse('\n'.join(events), fmt)), len(events))
+            self.check(fmt, '\n'.join(lines) + '\n')
+            self.check(fmt, '\r\n'.join(events))
+
+    def test_shuffled(self):
+        rnd = random.Random(1)
+        for fmt, lines in LINES.items():
+            tokens = ' '.join(lines).split(' ')
+            for _ in range(300):
+                mixed = rnd.sample(lines, 5)
+                # Lines of the tokens of the others, in any order.
+                mixed += [' '.join(rnd.choice(tokens) for _ in range(rnd.randint(1, 6))) for _ in range(5)]
+                rnd.shuffle(mixed)
+                self.check(fmt, '\n'.join(mixed))
+
+
+if __name__ == '__main__':
+    unittest.main()
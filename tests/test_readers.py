@@ -0,0 +1,75 @@
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import bz2
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import engine
+
+# The texts of the streams of a file, like pbzip2 writes.
+STREAMS = ['2013-06-01 00:00:00 launch url\n' * 40, '2013-06-01 00:00:01 3f2a-11 url 1.5\n' * 25, 'garbage\n']
+
+
+def gzip_compress(text):
+    fd = StringIO()
+    with gzip.GzipFile(fileobj=fd, mode='wb') as compressed:
+        compressed.write(text)
+    return fd.getvalue()
+
+
+class DecompressingReaderTest(unittest.TestCase):
+    """ DecompressingReader reads every stream of a file, wherever the
+    blocks it reads end. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, compress, new_decompressor):
+        streams = [compress(text) for text in STREAMS]
+        path = os.path.join(self.directory, 'streams')
+        with open(path, 'wb') as fd:
+            fd.write(''.join(streams))
+        first = len(streams[0])
+        # A stream ends on the edge of a block, or within one.
+        for block_size in [first, first - 1, first + 1, len(streams[0] + streams[1]), 1, 7]:
+            with engine.DecompressingReader(path, new_decompressor, block_size=block_size) as reader:
+                self.assertEqual(''.join(iter(reader.read, '')), ''.join(STREAMS), 'block size %d' % block_size)
+
+    def test_bz2(self):
+        self.check(bz2.compress, bz2.BZ2Decompressor)
+
+    def test_gzip(self):
+        self.check(gzip_compress, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+
+
+if __name__ == '__main__':
+    unittest.main()
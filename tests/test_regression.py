@@ -0,0 +1,239 @@
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import bz2
+import glob
+import gzip
+import imp
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import generate_log
+from engine import READ_BLOCK_SIZE
+
+# The logs the evaluators run on: the LogGenerator arguments and the lines.
+# The spring one is longer than the day of the trial, which is not billed.
+LOGS = {
+    'spring': (dict(fmt='spring', rate=0.1, machines=12, churn=30, seed=2), 16000),
+    'fall': (dict(fmt='fall', rate=2.0, machines=16, churn=120, seed=1), 8000),
+    # Jobs only, for the strategies to launch the machines.
+    'jobs': (dict(fmt='spring', rate=0.1, machines=0, churn=0, seed=2), 16000),
+}
+# What the original evaluator.py and 2013-fall-evaluator.py wrote on the
+# logs, the spring one choosing its machines with the random generators of
+# SEED. Ties between machines decide these, so the order the machines are
+# tried in changes them.
+REFERENCE = {
+    'spring': '1650\n',
+    'fall': '88952.3809524\n1\n',
+}
+SEED = ['--seed', '1']
+# A strategy module of SimpleCompetitor classes fixed to a number of
+# machines, to run serially what a sweep runs with parameters.
+FIXED_COMPETITOR = '''
+class Machines%(machines)d(simple_competitor.SimpleCompetitor):
+    def __init__(self):
+        super(Machines%(machines)d, self).__init__(%(machines)d)
+'''
+GUID_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def run(script, args, stdin=None, env=None):
+    """ Runs the script with the arguments, and returns its exit status,
+    output and errors. """
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, script)] + args, stdin=stdin,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, err = process.communicate()
+    return process.returncode, out, err
+
+
+def number_guids(text):
+    """ The text with its guids numbered in the order they first appear,
+    as the guids of the machines are new in every run. """
+    numbers = {}
+    return GUID_RE.sub(lambda m: 'guid-%d' % numbers.setdefault(m.group(0), len(numbers)), text)
+
+
+class RegressionTest(unittest.TestCase):
+    """ Every mode of the evaluators writes the reference output. """
+
+    # Shows the outputs which differ along with the arguments.
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.logs = {}
+        for name, (arguments, lines) in LOGS.items():
+            path = os.path.join(cls.directory, '%s.log' % name)
+            with open(path, 'w') as fd:
+                generate_log.write_log(generate_log.LogGenerator(**arguments), lines, fd)
+            with open(path) as fd:
+                text = fd.read()
+            for suffix, new_file in [('.bz2', bz2.BZ2File), ('.gz', gzip.open)]:
+                compressed = new_file(path + suffix, 'wb')
+                compressed.write(text)
+                compressed.close()
+            cls.logs[name] = path
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def spring(self, args, stdin=None):
+        status, out, err = run('evaluator.py', SEED + args, stdin)
+        self.assertEqual((status, out), (0, REFERENCE['spring']), '%s\n%s' % (' '.join(args), err))
+
+    def fall(self, args, path):
+        # The first file, the input of the contest, is not read.
+        status, out, err = run('2013-fall-evaluator.py', args + [os.devnull, path])
+        self.assertEqual((status, out), (0, REFERENCE['fall']), '%s %s\n%s' % (' '.join(args), path, err))
+
+    def compile(self, script, name):
+        path = os.path.join(self.directory, '%s.events' % name)
+        status, _, err = run(script, ['--compile', path, self.logs[name]])
+        self.assertEqual(status, 0, err)
+        return path
+
+    def test_spring(self):
+        path = self.logs['spring']
+        for args in [[], ['--parallel'], ['--event-core'], ['--batch-billing'],
+                     ['--event-core', '--batch-billing'], ['--pipeline']]:
+            self.spring(args + [path])
+        with open(path) as fd:
+            self.spring([], fd)
+
+    def test_spring_seed(self):
+        # The machine choices of a seed are the same whatever the hashing of
+        # the strings.
+        path = os.path.join(self.directory, 'trace')
+        traces = []
+        for hash_seed in ['1', '2']:
+            status, _, err = run('evaluator.py', SEED + ['--trace', path, self.logs['spring']],
+                                 env=dict(os.environ, PYTHONHASHSEED=hash_seed))
+            self.assertEqual(status, 0, err)
+            with open(path) as fd:
+                traces.append(number_guids(fd.read()))
+        self.assertEqual(traces[0], traces[1])
+
+    def test_spring_compressed(self):
+        for suffix in ['.bz2', '.gz']:
+            for args in [[], ['--parallel'], ['--event-core']]:
+                self.spring(args + [self.logs['spring'] + suffix])
+
+    def test_spring_compiled(self):
+        path = self.compile('evaluator.py', 'spring')
+        for args in [[], ['--event-core'], ['--batch-billing']]:
+            self.spring(args + [path])
+
+    def test_spring_resume(self):
+        evaluator = imp.load_source('spring_evaluator', os.path.join(ROOT, 'evaluator.py'))
+        for args in [[], ['--event-core'], ['--batch-billing']]:
+            snapshots = os.path.join(self.directory, 'resume')
+            os.mkdir(snapshots)
+            try:
+                checkpoint = os.path.join(snapshots, '{events}.snapshot')
+                self.spring(args + ['--checkpoint', checkpoint, self.logs['spring']])
+                # The snapshots are written between input blocks, so the
+                # small blocks of a reader of its own give several.
+                state = (evaluator.EventState if '--event-core' in args else evaluator.State)(
+                    None, int(SEED[1]), batch_billing='--batch-billing' in args)
+                reader = evaluator.InputReader(self.logs['spring'], block_size=1 << 16)
+                evaluator.run_checkpointed(state, reader, checkpoint=checkpoint, every_events=3000)
+                self.assertEqual('%s\n' % state.evaluate(), REFERENCE['spring'])
+                paths = glob.glob(os.path.join(snapshots, '*.snapshot'))
+                self.assertTrue(len(paths) > 1)
+                for path in paths:
+                    self.spring(['--resume', path])
+            finally:
+                shutil.rmtree(snapshots)
+
+    def test_spring_resume_leading_lines(self):
+        # The first input blocks hold no event, only lines the parser skips.
+        padded = os.path.join(self.directory, 'padded.log')
+        with open(padded, 'w') as fd:
+            fd.write('# no event\n' * (READ_BLOCK_SIZE / 10 + 1))
+            with open(self.logs['spring']) as log:
+                fd.write(log.read())
+        snapshots = os.path.join(self.directory, 'resume')
+        os.mkdir(snapshots)
+        try:
+            checkpoint = os.path.join(snapshots, '{events}.snapshot')
+            self.spring(['--checkpoint', checkpoint, '--checkpoint-seconds', '3600', padded])
+            paths = glob.glob(os.path.join(snapshots, '*.snapshot'))
+            self.assertTrue(len(paths) > 0)
+            for path in paths:
+                self.spring(['--resume', path])
+        finally:
+            shutil.rmtree(snapshots)
+
+    def test_spring_sweep(self):
+        # A sweep bills every parameter set as a serial run with it does,
+        # the one machine a category short of the jobs and the five enough.
+        machines = [1, 5]
+        with open(os.path.join(self.directory, 'fixed_competitors.py'), 'w') as fd:
+            fd.write('import simple_competitor\n')
+            for count in machines:
+                fd.write(FIXED_COMPETITOR % {'machines': count})
+        status, out, err = run('evaluator.py', SEED + ['--strategy', 'simple_competitor:SimpleCompetitor', '--sweep',
+                                                       'machines=%s' % ','.join(map(str, machines)), self.logs['jobs']])
+        self.assertEqual(status, 0, err)
+        rows = []
+        for count in machines:
+            status, bill, err = run('evaluator.py', SEED + ['--strategy', 'fixed_competitors:Machines%d' % count,
+                                                            self.logs['jobs']],
+                                    env=dict(os.environ, PYTHONPATH=self.directory))
+            self.assertEqual(err, '')
+            rows.append('machines=%d %s%s' % (count, bill.strip(), ' overwait' if status else ''))
+        self.assertEqual(out.splitlines(), rows)
+        self.assertEqual([row.endswith(' overwait') for row in rows], [True, False])
+
+    def test_fall(self):
+        path = self.logs['fall']
+        for args in [[], ['--batch-billing'], ['--event-core'], ['--event-core', '--batch-billing']]:
+            for suffix in ['', '.bz2', '.gz']:
+                self.fall(args, path + suffix)
+            self.fall(args, self.compile('2013-fall-evaluator.py', 'fall'))
+
+    def test_fall_batch(self):
+        outputs = os.path.join(self.directory, 'outputs')
+        os.mkdir(outputs)
+        try:
+            for suffix in ['', '.bz2', '.gz']:
+                shutil.copy(self.logs['fall'] + suffix, outputs)
+            shutil.copy(self.compile('2013-fall-evaluator.py', 'fall'), outputs)
+            status, out, err = run('2013-fall-evaluator.py', ['--batch', outputs])
+            self.assertEqual(status, 0, err)
+            rows = [line.split('\t') for line in out.splitlines()[1:]]
+            self.assertEqual([(row[4], row[5]) for row in rows], [('1', REFERENCE['fall'].split()[0])] * 4)
+        finally:
+            shutil.rmtree(outputs)
+
+
+if __name__ == '__main__':
+    unittest.main()
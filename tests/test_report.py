@@ -0,0 +1,110 @@
+#
+# Copyright (c) 2013 prezi.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import collections
+import csv
+import json
+import math
+import os
+import random
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import engine
+import generate_log
+from test_regression import LOGS, SEED
+
+
+class WaitSketchTest(unittest.TestCase):
+    """ A percentile of the sketch is the upper bound of the bin of the
+    exact one, within 10% of it. """
+
+    def test_percentiles(self):
+        rnd = random.Random(1)
+        waits = [0.0] * 100 + [rnd.lognormvariate(0, 3) for _ in range(5000)] + [0.001, 1e-4]
+        sketch = engine.WaitSketch()
+        for wait in waits:
+            sketch.add(wait)
+        waits.sort()
+        for percent in [1, 10, 25, 50, 75, 90, 99, 99.9, 100]:
+            exact = waits[int(math.ceil(len(waits) * percent / 100.0)) - 1]
+            found = sketch.percentile(percent)
+            # Waits under a millisecond fall in the bin of a millisecond.
+            self.assertTrue(exact <= found <= min(max(exact * 1.1, 0.001), waits[-1]), (percent, exact, found))
+        self.assertEqual(sketch.percentile(100), waits[-1])
+        self.assertEqual(sketch.percentile(1), 0.0)
+
+    def test_empty(self):
+        self.assertEqual(engine.WaitSketch().percentile(50), 0.0)
+
+
+class ReportTest(unittest.TestCase):
+    """ The rows of a report add up to the bill of the run, once per hour
+    and category, in order. """
+
+    def report(self, name, state, fmt='csv'):
+        _, log_format = engine.RULES[name]
+        arguments, lines = LOGS[name]
+        text = StringIO()
+        generate_log.write_log(generate_log.LogGenerator(**arguments), lines, text)
+        fd = StringIO()
+        engine.attach_report(state, engine.Report(fd, fmt))
+        jobs = []
+        for event in engine.read_events(StringIO(text.getvalue()), log_format):
+            if isinstance(event, engine.Job):
+                jobs.append(event)
+            state.receive(event)
+        billed = state.evaluate()
+        if fmt == 'csv':
+            rows = list(csv.DictReader(StringIO(fd.getvalue())))
+        else:
+            rows = [json.loads(line, object_pairs_hook=collections.OrderedDict) for line in fd.getvalue().splitlines()]
+        keys = [(int(row['hour']), row['category']) for row in rows]
+        self.assertEqual(keys, sorted(set(keys)))
+        return billed, jobs, rows
+
+    def test_spring(self):
+        billed, _, rows = self.report('spring', engine.SpringState(seed=int(SEED[1])))
+        self.assertEqual(sum(int(row['billed']) for row in rows), billed)
+
+    def test_fall(self):
+        billed, jobs, rows = self.report('fall', engine.FallState())
+        penalty_hours = sum(int(row['penalty_hours']) for row in rows)
+        self.assertTrue(penalty_hours > 0)
+        self.assertEqual(sum(int(row['billed']) for row in rows) + penalty_hours, billed)
+        # Every job of the log gets a machine.
+        self.assertEqual(sum(int(row['jobs']) for row in rows), len(jobs))
+        self.assertAlmostEqual(sum(float(row['busy_seconds']) for row in rows), sum(job.duration for job in jobs),
+                               delta=0.001 * len(rows))
+        for row in rows:
+            self.assertTrue(float(row['busy_seconds']) <= float(row['machine_seconds']) + 0.001, row)
+
+    def test_json(self):
+        _, _, rows = self.report('fall', engine.FallState())
+        _, _, json_rows = self.report('fall', engine.FallState(), 'json')
+        self.assertEqual([[str(value) for value in row.values()] for row in json_rows],
+                         [[row[column] for column in engine.Report.COLUMNS] for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()